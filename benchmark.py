@@ -0,0 +1,282 @@
+#!/usr/bin/python3
+"""Benchmarks of the i3expod hot paths, without i3 nor a real display.
+
+i3 is replaced by a fake connection serving a synthetic set of outputs and workspaces, pygame runs on
+SDL's dummy video driver and screenshots are synthetic, unless --xvfb is given: then prtscn captures
+an Xvfb screen of the size of the outputs. Results are written as JSON, to compare runs:
+
+    ./benchmark.py --workspaces 20 --portrait 0.5 -o before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--workspaces", type=int, default=10, help="number of workspaces (default: 10)")
+parser.add_argument("--outputs", type=int, default=2, help="number of outputs (default: 2)")
+parser.add_argument("--resolution", default="1920x1080", help="resolution of the outputs (default: 1920x1080)")
+parser.add_argument("--portrait", type=float, default=0.5,
+                    help="fraction of the outputs rotated to portrait (default: 0.5)")
+parser.add_argument("--screen", default=None, help="size of the overview window (default: the resolution)")
+parser.add_argument("--repeat", type=int, default=20, help="runs of each benchmark (default: 20)")
+parser.add_argument("--xvfb", action="store_true", help="capture an Xvfb screen instead of synthetic screenshots")
+parser.add_argument("-o", "--output", default=None, help="write the results to this file (default: stdout)")
+bench_args = parser.parse_args()
+
+
+def parse_size(raw):
+    w, h = raw.lower().split('x')
+    return int(w), int(h)
+
+
+def make_outputs(count, resolution, portrait):
+    # [(name, x, y, w, h)], side by side, the first round(count * portrait) of them rotated
+    outputs = []
+    x = 0
+    for i in range(count):
+        w, h = resolution
+        if i < round(count * portrait):
+            w, h = h, w
+        outputs.append(('OUT-%d' % (i + 1), x, 0, w, h))
+        x += w
+    return outputs
+
+
+def start_xvfb(width, height):
+    # Xvfb on the first free display, returns the process once it accepts connections
+    display = next(n for n in range(99, 200) if not os.path.exists('/tmp/.X11-unix/X%d' % n))
+    xvfb = subprocess.Popen(['Xvfb', ':%d' % display, '-screen', '0', '%dx%dx24' % (width, height), '-nolisten', 'tcp'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        if os.path.exists('/tmp/.X11-unix/X%d' % display):
+            os.environ['DISPLAY'] = ':%d' % display
+            return xvfb
+        time.sleep(0.05)
+    xvfb.kill()
+    sys.exit("Xvfb did not start")
+
+
+outputs = make_outputs(bench_args.outputs, parse_size(bench_args.resolution), bench_args.portrait)
+screen_size = parse_size(bench_args.screen) if bench_args.screen else parse_size(bench_args.resolution)
+
+# Everything has to be in place before i3expod is imported: it connects to i3 and reads its arguments then
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+tmp_home = tempfile.mkdtemp(prefix='i3expo-bench-')
+os.environ['XDG_CONFIG_HOME'] = os.path.join(tmp_home, 'config')  # The default config, not the user's one
+os.environ['XDG_CACHE_HOME'] = os.path.join(tmp_home, 'cache')
+xvfb = None
+if bench_args.xvfb:
+    xvfb = start_xvfb(sum(o[3] for o in outputs), max(o[4] for o in outputs))
+
+import i3ipc
+from i3ipc.replies import OutputReply, WorkspaceReply
+
+
+def rect(x, y, w, h):
+    return {'x': x, 'y': y, 'width': w, 'height': h}
+
+
+class FakeConnection:
+    """Stands in for i3ipc.Connection: workspaces are spread over the outputs, the first one is focused."""
+
+    def __init__(self, *args, **kwargs):
+        self.outputs = outputs
+        self.workspaces = {num: outputs[(num - 1) % len(outputs)] for num in range(1, bench_args.workspaces + 1)}
+        self.focused = 1
+
+    def visible(self):
+        return {min(num for num, o in self.workspaces.items() if o == output) for output in self.outputs
+                if output in self.workspaces.values()}
+
+    def get_outputs(self):
+        return [OutputReply({'name': name, 'active': True, 'primary': i == 0, 'rect': rect(x, y, w, h),
+                             'current_workspace': None})
+                for i, (name, x, y, w, h) in enumerate(self.outputs)]
+
+    def get_workspaces(self):
+        visible = self.visible()
+        return [WorkspaceReply({'id': 1000 + num, 'num': num, 'name': str(num), 'visible': num in visible,
+                                'focused': num == self.focused, 'urgent': False, 'rect': rect(*o[1:]), 'output': o[0]})
+                for num, o in sorted(self.workspaces.items())]
+
+    def get_tree(self):
+        nodes = []
+        for i, (name, x, y, w, h) in enumerate(self.outputs):
+            workspaces = []
+            for num, o in sorted(self.workspaces.items()):
+                if o[0] != name:
+                    continue
+                window = {'id': 2000 + num, 'type': 'con', 'name': 'window %d' % num, 'window': 0x400000 + num,
+                          'rect': rect(x, y, w, h), 'window_rect': rect(0, 0, w, h), 'focused': num == self.focused,
+                          'nodes': [], 'floating_nodes': []}
+                workspaces.append({'id': 1000 + num, 'type': 'workspace', 'name': str(num), 'num': num,
+                                   'rect': rect(x, y, w, h), 'nodes': [window], 'floating_nodes': []})
+            content = {'id': 500 + i, 'type': 'con', 'name': 'content', 'rect': rect(x, y, w, h),
+                       'nodes': workspaces, 'floating_nodes': []}
+            nodes.append({'id': 100 + i, 'type': 'output', 'name': name, 'rect': rect(x, y, w, h),
+                          'nodes': [content], 'floating_nodes': []})
+        root = {'id': 1, 'type': 'root', 'name': 'root', 'nodes': nodes, 'floating_nodes': [],
+                'rect': rect(0, 0, sum(o[3] for o in self.outputs), max(o[4] for o in self.outputs))}
+        return i3ipc.Con(root, None, self)
+
+    def command(self, payload):
+        return []
+
+    def on(self, event, handler):
+        pass
+
+    def main(self, timeout=0.0):
+        pass
+
+
+i3ipc.Connection = FakeConnection
+sys.argv = [sys.argv[0]]
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pygame
+import prtscn
+import expolayout
+import i3expod
+
+
+def synthetic_buffer(x, y, w, h, scale=1):
+    return bytearray(b'\x40\x80\xc0\xff' * ((w // scale) * (h // scale)))
+
+
+if xvfb is None:
+    prtscn.getScreenBuffer = synthetic_buffer
+
+
+def timed(function, repeat=bench_args.repeat, setup=None):
+    # Milliseconds taken by each of repeat calls of function (setup is called before each of them, untimed)
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def summary(times):
+    times = sorted(times)
+    return {
+        'runs': len(times),
+        'min_ms': round(times[0], 3),
+        'median_ms': round(statistics.median(times), 3),
+        'mean_ms': round(statistics.mean(times), 3),
+        'p90_ms': round(times[min(len(times) - 1, int(len(times) * 0.9))], 3),
+        'max_ms': round(times[-1], 3),
+    }
+
+
+def time_to_first_frame():
+    # From the show command to the first flip of the overview, then close it again
+    flips = []
+    flip = pygame.display.flip
+
+    def timed_flip():
+        flips.append(time.perf_counter())
+        flip()
+
+    pygame.display.flip = timed_flip
+    try:
+        start = time.perf_counter()
+        i3expod.toggle_overview()
+        while not flips:
+            time.sleep(0.001)
+        i3expod.toggle_overview()  # And off again
+        while not i3expod.global_updates_running:
+            time.sleep(0.001)
+        # show_ui resets the flag just before returning
+        time.sleep(0.01)
+    finally:
+        pygame.display.flip = flip
+    return (flips[0] - start) * 1000
+
+
+def run():
+    i3expod.read_config()
+    i3expod.init_knowledge()
+    i3expod.global_knowledge['monitor_size'] = screen_size
+    i3expod.update_state()
+
+    name, x, y, w, h = outputs[0]
+    results = {}
+
+    results['grab_screen'] = summary(timed(lambda: i3expod.grab_screen(x, y, w, h)))
+    scale = i3expod.get_preview_scale(w, h)
+    results['grab_screen_preview'] = summary(timed(lambda: i3expod.grab_screen(x, y, w, h, scale)))
+    results['update_state'] = summary(timed(i3expod.update_state))
+
+    frame = i3expod.expo_frame
+    def compute_layout():
+        return i3expod.get_layout(screen_size, i3expod.workspace_model.get_outputs())
+
+    results['layout'] = summary(timed(compute_layout, setup=expolayout.compute_layout.cache_clear))
+
+    def redraw():
+        with i3expod.state_lock:
+            frame.refresh(screen_size)
+
+    # Everything from scratch, then the tiles of the overview only (what a new screenshot costs)
+    results['draw_cold'] = summary(timed(redraw, setup=lambda: (frame.invalidate(),
+                                                                 i3expod.thumbnail_cache.clear(),
+                                                                 i3expod.global_knowledge['ui_cache'].clear())))
+    results['draw_all_tiles'] = summary(timed(redraw, setup=lambda: (frame.invalidate(),
+                                                                      i3expod.thumbnail_cache.clear())))
+    results['draw_tile'] = summary(timed(redraw, setup=lambda: (frame.invalidate(1),
+                                                                 i3expod.thumbnail_cache.clear())))
+    results['draw_tile_cached_thumbnail'] = summary(timed(redraw, setup=lambda: frame.invalidate(1)))
+
+    screenshot = i3expod.previews.get(1)
+    layout = frame.layout
+    size = (layout.tiles[1].inner_w, layout.tiles_inner_h)
+    results['thumbnail_scale'] = summary(timed(lambda: pygame.transform.smoothscale(screenshot, size)))
+
+    results['first_frame_cold'] = summary([time_to_first_frame()])
+    results['first_frame'] = summary([time_to_first_frame() for _ in range(bench_args.repeat)])
+    return results
+
+
+def main():
+    try:
+        results = run()
+    finally:
+        if xvfb is not None:
+            xvfb.kill()
+        shutil.rmtree(tmp_home, ignore_errors=True)
+
+    report = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'pygame': pygame.version.ver,
+        'capture': 'xvfb' if xvfb is not None else 'synthetic',
+        'parameters': {
+            'workspaces': bench_args.workspaces,
+            'outputs': ['%dx%d' % o[3:] for o in outputs],
+            'screen': '%dx%d' % screen_size,
+            'repeat': bench_args.repeat,
+        },
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if bench_args.output is None:
+        print(text)
+    else:
+        with open(bench_args.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
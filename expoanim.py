@@ -0,0 +1,99 @@
+"""Animations of the i3expo overview.
+
+Animations are timelines: their value only depends on the time elapsed since they started, so a frame
+which is late (or never drawn) doesn't slow them down, the next one just shows them further along. The
+overview keeps handling its events in between: an Animator only says how long it can wait for one
+before the next frame is due.
+"""
+
+import time
+
+
+def linear(t):
+    return t
+
+
+def ease_out_cubic(t):
+    return 1 - (1 - t) ** 3
+
+
+def ease_in_out_quad(t):
+    return 2 * t * t if t < 0.5 else 1 - (-2 * t + 2) ** 2 / 2
+
+
+class Animation:
+    """A value going from 0 to 1 in duration seconds, through easing."""
+
+    def __init__(self, duration, easing=ease_out_cubic):
+        self.duration = duration
+        self.easing = easing
+        self.start = time.perf_counter()
+
+    def progress(self, now=None):
+        if self.duration <= 0:
+            return 1.0
+        now = time.perf_counter() if now is None else now
+        t = min(max((now - self.start) / self.duration, 0.0), 1.0)
+        return self.easing(t)
+
+    def done(self, now=None):
+        now = time.perf_counter() if now is None else now
+        return now - self.start >= self.duration
+
+    def finish(self):
+        self.start = time.perf_counter() - self.duration
+
+
+def lerp_rect(a, b, t):
+    # (x, y, w, h) between the rects a (t = 0) and b (t = 1)
+    return tuple(round(u + (v - u) * t) for u, v in zip(a, b))
+
+
+class Animator:
+    """Frame pacing of the running animations.
+
+    Call timeout() for how long to wait for events, due() to know if a frame should be drawn now (at the
+    time now of the timelines), and presented() once it's on screen. A frame which overran its budget isn't
+    caught up with: the next one is drawn right away, at the current time of the timelines, and the frames
+    in between are skipped.
+    """
+
+    def __init__(self, fps=60):
+        self.frame_time = 1 / fps
+        self.animations = []
+        self.next_frame = 0.0
+        self.now = 0.0
+        self.skipped = 0
+
+    def start(self, animation):
+        if not self.animations:
+            self.next_frame = time.perf_counter()
+        self.animations.append(animation)
+        return animation
+
+    def stop(self, animation):
+        if animation in self.animations:
+            self.animations.remove(animation)
+
+    def running(self):
+        return bool(self.animations)
+
+    def timeout(self, idle_ms):
+        # Milliseconds to wait for an event: until the next frame while animating
+        if not self.animations:
+            return idle_ms
+        return max(0, round((self.next_frame - time.perf_counter()) * 1000))
+
+    def due(self):
+        self.now = time.perf_counter()
+        return bool(self.animations) and self.now >= self.next_frame
+
+    def presented(self):
+        # A frame was drawn: forget the animations it finished and schedule the next frame
+        self.animations = [a for a in self.animations if not a.done(self.now)]
+        now = time.perf_counter()
+        late = now - self.next_frame
+        if late > self.frame_time:
+            self.skipped += int(late / self.frame_time)
+            self.next_frame = now
+        self.next_frame += self.frame_time
@@ -0,0 +1,128 @@
+"""Tile layout of the i3expo overview.
+
+Everything here is a pure function of the workspace sizes, the outputs, the screen size and the
+spacing options, so layouts are memoized on them: redrawing (or hit-testing) the same overview
+doesn't place the tiles again.
+"""
+
+import math
+from collections import namedtuple
+from functools import lru_cache
+
+# x, y, outer_w and inner_w of a tile: portrait workspaces get narrower tiles than the others,
+# while the height of all the tiles (Layout.tiles_outer_h / tiles_inner_h) is the same
+Tile = namedtuple('Tile', ['x', 'y', 'outer_w', 'inner_w'])
+
+Layout = namedtuple('Layout', [
+    'pad_w', 'pad_h',  # Padding/margin for tiles
+    'tiles_gap_w', 'tiles_gap_h',  # Gap between tiles (do not confuse with frames)
+    'tiles_outer_w', 'tiles_outer_h',  # Outer and inner tiles size (draw outer then inner to get the frame)
+    'tiles_inner_w', 'tiles_inner_h',
+    'wss_idx',  # Workspace indexes, existing ones first, then the new ones (one per output)
+    'new_wss_output',  # {new workspace index: name of the output it would be created on}
+    'tiles',  # {workspace index: Tile}
+    'kbd_grid',  # Desktop index matrix for keyboard navigation, -1 where there's no tile
+])
+
+
+@lru_cache(maxsize=64)
+def compute_layout(workspaces, outputs, screen_size, padding_percent, spacing_percent, frame_thickness,
+                   mode="filler"):
+    """Place the tiles of the overview.
+
+    workspaces is a tuple of (num, (width, height)), outputs a tuple of (name, (width, height)),
+    padding_percent and spacing_percent are (x, y) percentages of the screen size. All of them
+    must be hashable, as the result is memoized on them: don't modify the returned Layout.
+    """
+    screen_w, screen_h = screen_size
+    ws_sizes = dict(workspaces)
+    out_sizes = dict(outputs)
+
+    # Calculate grid size in a more efficient way taking into account orientation:
+    # Vertical screens take about 1/3 of the horizontal size so we can fit more frames in a row.
+    # BUT the exact proportions (w / (h / (w / h))) can't be used because with any gap between frames
+    # we can't really fit any more than two vertical frames, hence tmp += 1/2
+    tmp = 0
+    for w, h in list(ws_sizes.values()) + list(out_sizes.values()):
+        if h > w:
+            # tmp += (w / (h / (w / h) ))  # exact
+            tmp += 1 / 2  # any gap approximation
+        else:
+            tmp += 1
+
+    grid_x = grid_y = math.ceil(math.sqrt(tmp))
+    grid_size = math.ceil(math.sqrt(len(ws_sizes) + len(out_sizes)))
+
+    pad_w = round(screen_w * padding_percent[0] / 100)
+    pad_h = round(screen_h * padding_percent[1] / 100)
+    tiles_gap_w = round(screen_w * spacing_percent[0] / 100)
+    tiles_gap_h = round(screen_h * spacing_percent[1] / 100)
+    tiles_outer_w = round((screen_w - 2 * pad_w - tiles_gap_w * (grid_x - 1)) / grid_x)
+    tiles_outer_h = round((screen_h - 2 * pad_h - tiles_gap_h * (grid_y - 1)) / grid_y)
+    tiles_inner_w = tiles_outer_w - 2 * frame_thickness
+    tiles_inner_h = tiles_outer_h - 2 * frame_thickness
+
+    # Gap between frames
+    frames_gap_h = tiles_outer_h + tiles_gap_h
+
+    # Get existing workspaces indexes
+    wss_idx = [int(k) for k in ws_sizes.keys()]
+    # Sort workspace indexes by aspect ratio (landscape then portrait)
+    wss_idx.sort(key=lambda x: ws_sizes[x][1])
+
+    # Generate one new/empty ws for each display output available:
+    new_wss_output = {}
+    tmp = []
+    if mode == "sequential":
+        r = max(1000, wss_idx[-1])  # or r = 1000
+    else:
+        r = 1
+    for name in out_sizes.keys():
+        while r in wss_idx + tmp:
+            r += 1
+        new_wss_output[r] = name
+        tmp.append(r)
+
+    # Sort NEW workspace indexes by aspect ratio (portrait then landscape) and append them to the list of workspaces
+    tmp.sort(key=lambda x: out_sizes[new_wss_output[x]][0])
+    wss_idx.extend(tmp)
+
+    def tile_width(idx):
+        # Resize frame width for vertical workspaces
+        ws_width, ws_height = ws_sizes[idx] if idx in ws_sizes.keys() else out_sizes[new_wss_output[idx]]
+        if ws_height > ws_width:
+            factor = (ws_height / (ws_width / (ws_height / ws_width)))
+            return round(tiles_outer_w / factor)
+        return tiles_outer_w
+
+    # Fill the rows one by one, each time with the first workspace which still fits on it
+    kbd_grid = [[-1 for _ in range(grid_size * grid_size)] for _ in range(grid_y)]
+    tiles = {}
+    wss_idx_todo = [(idx, tile_width(idx)) for idx in wss_idx]
+    for y in range(grid_y):
+        tile_last_x = 0
+        for x in range(grid_x * grid_x):
+            # Origin point for next tile will be after the last one on this row
+            tile_origin_x = tile_last_x + tiles_gap_w if tile_last_x != 0 else pad_w
+            tile_origin_y = pad_h + frames_gap_h * y
+
+            i = next((i for i, (idx, w) in enumerate(wss_idx_todo) if tile_origin_x + w <= screen_w - pad_w), None)
+            if i is None:
+                break
+            index, tiles_outer_w_dyn = wss_idx_todo.pop(i)
+
+            tile_last_x = tile_origin_x + tiles_outer_w_dyn
+            kbd_grid[y][x] = index
+            tiles[index] = Tile(tile_origin_x, tile_origin_y, tiles_outer_w_dyn,
+                                tiles_outer_w_dyn - 2 * frame_thickness)
+
+    return Layout(pad_w, pad_h, tiles_gap_w, tiles_gap_h, tiles_outer_w, tiles_outer_h, tiles_inner_w, tiles_inner_h,
+                  tuple(wss_idx), new_wss_output, tiles, tuple(tuple(row) for row in kbd_grid))
+
+
+def hit_test(layout, pos):
+    # Index of the tile under pos, if any
+    for index, tile in layout.tiles.items():
+        if tile.x < pos[0] < tile.x + tile.outer_w and tile.y < pos[1] < tile.y + layout.tiles_outer_h:
+            return index
+    return None
@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+"""Send a command to a running i3expod through its control socket.
+
+For example, in the i3 config: bindsym $mod+Tab exec --no-startup-id i3expoctl toggle
+
+"i3expoctl subscribe" prints a line of JSON each time the screenshot of a workspace is exported (with
+export enabled in the config), until it's interrupted.
+"""
+
+import argparse
+import os
+import socket
+import sys
+
+COMMANDS = ['show', 'hide', 'toggle', 'reload', 'stats', 'dump', 'subscribe']
+
+
+def socket_path():
+    # Same place as i3expod's runtime_path("control.sock")
+    base = os.environ.get('XDG_RUNTIME_DIR') or os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, "i3expo", "control.sock")
+
+
+def send(command, timeout=15):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path())
+        sock.sendall((command + "\n").encode())
+        return sock.makefile('r').readline().strip()
+
+
+def subscribe():
+    # Lines of the preview export events, as they come
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path())
+        sock.sendall(b"subscribe\n")
+        for line in sock.makefile('r'):
+            yield line.strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=COMMANDS, help="show, hide or toggle the overview, reload the config, "
+                                                          "print the stats, dump them to stats.json or "
+                                                          "follow the preview export")
+    args = parser.parse_args()
+
+    if args.command == 'subscribe':
+        try:
+            for line in subscribe():
+                print(line, flush=True)
+                if line.startswith("error"):
+                    sys.exit(1)
+        except KeyboardInterrupt:
+            pass
+        except OSError as e:
+            print("Could not reach i3expod on " + socket_path() + ": " + str(e), file=sys.stderr)
+            sys.exit(2)
+        return
+
+    try:
+        reply = send(args.command)
+    except OSError as e:
+        print("Could not reach i3expod on " + socket_path() + ": " + str(e), file=sys.stderr)
+        sys.exit(2)
+
+    print(reply)
+    if not reply or reply.startswith("error"):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
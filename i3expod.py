@@ -12,40 +12,36 @@ import sys
 import pprint
 import time
 import argparse
-import subprocess
 import math
-from threading import Thread
+import select
+import itertools
+import hashlib
+import zlib
+import mmap
+import struct
+import json
+import stat
+import queue
+import socket
+from collections import OrderedDict, deque, namedtuple
+from enum import Enum
+from types import MappingProxyType
+from threading import Thread, Condition, Event, Lock, RLock
 import prtscn
+import expolayout
+import expoanim
 
 try:
-    from xdg import xdg_config_home
+    from xdg import xdg_config_home, xdg_cache_home
 
     xdg_config_home = str(xdg_config_home())
+    xdg_cache_home = str(xdg_cache_home())
 except ImportError:
-    from xdg.BaseDirectory import xdg_config_home
-from contextlib import suppress
+    from xdg.BaseDirectory import xdg_config_home, xdg_cache_home
+from contextlib import suppress, contextmanager
 from PIL import ImageFilter, ImageEnhance, Image
 
 
-def get_primary_output_name():
-    stdout, stderr = subprocess.Popen('xrandr --listmonitors',
-                                      shell=True, stdout=subprocess.PIPE).communicate()
-    if stdout != '':
-        monitorlines = stdout.decode().split("\n")
-        # Search for the primary (marked with +*)
-        # If none found (e.g. primary is on a disconnected output), take the first
-        primary = None
-        for m in monitorlines:
-            if "+*" in m:
-                primary = m
-                break  # Early exit from the cycle
-            elif "+" in m:
-                primary = m  # We found a monitor. Keep it
-        if primary != None:
-            return primary.split()[-1]
-    return None
-
-
 parser = argparse.ArgumentParser()
 parser.add_argument("-f", "--fullscreen", action="store_true",
                     help="run in fullscreen")
@@ -59,18 +55,128 @@ args = parser.parse_args()
 pp = pprint.PrettyPrinter(indent=4)
 
 YELLOW = (255, 255, 0)
+# How long the overview sleeps waiting for input before checking whether it's been closed
+IDLE_TIMEOUT_MS = 500
+# Workspace the overview is shown on, not one of the user's
+TEMPORARY_WORKSPACE = 'i3expod-temporary-workspace'
 
 global_updates_running = True
-last_update = 0
-global_knowledge = {'active': 0, 'wss': {}, 'ui_cache': {}, 'visible_ws_primary': None, 'out_aliases': {}}
+# Serializes the updates of global_knowledge done by the capture worker and the signal handlers
+state_lock = RLock()
+global_knowledge = {'active': 0, 'wss': {}, 'ui_cache': {}, 'visible_ws_primary': None, 'visible_ws_primary_name': None,
+                    'out_aliases': {}}
+
+
+def runtime_path(name):
+    # Files of the running daemon (control socket, stats), in the XDG runtime directory. Without one, the
+    # XDG cache rather than a /tmp shared with the other users
+    return os.path.join(os.environ.get('XDG_RUNTIME_DIR') or xdg_cache_home, "i3expo", name)
+
+
+def make_runtime_dir():
+    # Create the directory of runtime_path, refusing to use it unless it's only ours
+    path = os.path.dirname(runtime_path(""))
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+        raise PermissionError(path + " is not a directory of this user")
+    if stat.S_IMODE(st.st_mode) != 0o700:
+        os.chmod(path, 0o700)
+    return path
+
+
+class Stats:
+    """Latency of the stages of a capture and of the overview, plus counters (captures, cache hits...).
+
+    Only collected when enabled in the [STATS] section of the config. Every stage keeps its last samples,
+    so that the percentiles follow what happened recently. Send SIGUSR2 to write them to stats.json in
+    the XDG runtime directory.
+    """
+
+    def __init__(self, samples=500):
+        self.enabled = False
+        self.lock = Lock()
+        self.samples = samples
+        self.timings = {}  # stage -> deque of the last durations, in ms
+        self.counters = {}
+        self.started = time.time()
+
+    @contextmanager
+    def timer(self, stage):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, (time.perf_counter() - start) * 1000)
+
+    def record(self, stage, duration):
+        if not self.enabled:
+            return
+        with self.lock:
+            if stage not in self.timings.keys():
+                self.timings[stage] = deque(maxlen=self.samples)
+            self.timings[stage].append(duration)
+
+    def count(self, counter, n=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def snapshot(self):
+        with self.lock:
+            timings = {stage: sorted(samples) for stage, samples in self.timings.items()}
+            counters = dict(self.counters)
+
+        def percentile(samples, p):
+            return round(samples[min(len(samples) - 1, int(len(samples) * p / 100))], 3)
+
+        layout_cache = expolayout.compute_layout.cache_info()
+        counters['layout_cache_hits'] = layout_cache.hits
+        counters['layout_cache_misses'] = layout_cache.misses
+        return {
+            'enabled': self.enabled,
+            'uptime_s': round(time.time() - self.started),
+            'counters': counters,
+            'timings_ms': {stage: {'count': len(samples),
+                                   'p50': percentile(samples, 50),
+                                   'p90': percentile(samples, 90),
+                                   'p99': percentile(samples, 99),
+                                   'max': round(samples[-1], 3)}
+                           for stage, samples in timings.items() if samples},
+        }
+
+    def dump(self):
+        path = runtime_path("stats.json")
+        try:
+            make_runtime_dir()
+            with suppress(FileNotFoundError):
+                os.unlink(path + ".tmp")  # Left behind by a failed dump
+            with open(os.open(path + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o600), 'w') as f:
+                json.dump(self.snapshot(), f, indent=2)
+            os.replace(path + ".tmp", path)
+            print("Stats written to " + path)
+        except OSError as e:
+            print("Could not write the stats: " + str(e))
+        return path
+
+
+stats = Stats()
 
 pygame.display.init()
 pygame.font.init()
+# Posted to wake the overview up when it's toggled off
+CLOSE_EVENT = pygame.event.custom_type()
 i3 = i3ipc.Connection(auto_reconnect=True)
 
 
 def signal_quit(signal, frame):
     print("Shutting down...")
+    if preview_file.enabled:
+        preview_file.save()
     pygame.display.quit()
     pygame.quit()
     i3.main_quit()
@@ -78,45 +184,173 @@ def signal_quit(signal, frame):
 
 
 def signal_reload(signal, frame):
-    read_config()
+    dispatcher.submit('reload')
+
+
+def signal_stats(signal, frame):
+    dispatcher.submit('dump')
 
 
 def signal_show(signal, frame):
+    dispatcher.submit('toggle')
+
+
+def reload_config():
+    read_config()
+    return "ok"
+
+
+def hide_overview():
     global global_updates_running
-    # toggles expo view
-    if not global_updates_running:
-        global_updates_running = True
+    if global_updates_running:
+        return "ok: not shown"
+    global_updates_running = True
+    pygame.event.post(pygame.event.Event(CLOSE_EVENT))
+    return "ok"
+
+
+def show_overview():
+    global global_updates_running, ui_thread
+    if ui_thread is not None and ui_thread.is_alive():
+        if not global_updates_running:
+            return "ok: already shown"
+        # Still closing: wait for it, rather than having two overviews fighting over the window
+        ui_thread.join()
+
+    global_knowledge['show_requested'] = time.perf_counter()
+    if damage_monitor.is_alive():
+        # The screenshots follow the damage: only take the ones still waiting for their delay
+        capture_worker.capture(capture_worker.take_pending())
     else:
-        update_state(i3, None)  # for a <1s updated screenshot of the primary ws upon calling
-        global_updates_running = False
+        update_state()  # for a <1s updated screenshot of the primary ws upon calling
+    with state_lock:
+        global_updates_running = False  # Captures still being taken won't be published
+    global_knowledge['active'] = workspace_model.focused()['num']
 
-        # Take a screenshot of the focused window for the window drag overlay
+    # Take a screenshot of the focused window for the window drag overlay
+    with stats.timer('tree'):
         focused_win = i3.get_tree().find_focused()
-        screenshot = grab_screen(x=focused_win.rect.x, y=focused_win.rect.y,
-                                 w=focused_win.rect.width, h=focused_win.rect.height)
-        global_knowledge['wss'][global_knowledge['active']]['focused_win_screenshot'] = screenshot
-        global_knowledge['wss'][global_knowledge['active']]['focused_win_name'] = focused_win.name
-        global_knowledge['wss'][global_knowledge['active']]['focused_win_id'] = focused_win.id
-        global_knowledge['wss'][global_knowledge['active']]['focused_win_size'] = \
-            (focused_win.window_rect.width, focused_win.window_rect.height)
-
-        # Open the expo view on the primary output:
-        # 1) Get primary monitor name
-        primary_output_name = get_primary_output_name()
+    screenshot = grab_screen(x=focused_win.rect.x, y=focused_win.rect.y,
+                             w=focused_win.rect.width, h=focused_win.rect.height,
+                             scale=get_preview_scale(focused_win.rect.width, focused_win.rect.height))
+    global_knowledge['wss'][global_knowledge['active']]['focused_win_screenshot'] = screenshot
+    global_knowledge['wss'][global_knowledge['active']]['focused_win_name'] = focused_win.name
+    global_knowledge['wss'][global_knowledge['active']]['focused_win_id'] = focused_win.id
+    global_knowledge['wss'][global_knowledge['active']]['focused_win_size'] = \
+        (focused_win.window_rect.width, focused_win.window_rect.height)
+
+    # Open the expo view on the primary output:
+    # 1) Get primary monitor name
+    primary_output_name = workspace_model.primary_output_name()
+
+    # 2) Get the visible workspace on the primary monitor
+    visible_ws_primary = [w['num'] for w in workspace_model.get_workspaces()
+                          if w['visible'] and w['output'] == primary_output_name][0]
+    global_knowledge['visible_ws_primary'] = visible_ws_primary
+    # Kept by name: the workspace may be gone (emptied) by the time the overview goes back to it
+    global_knowledge['visible_ws_primary_name'] = global_knowledge["wss"][visible_ws_primary]['name']
+
+    # 3) First move to the active ws on the primary output, then create a temporary workspace for the expo view
+    i3.command('workspace ' + global_knowledge['visible_ws_primary_name'] + '; workspace ' + TEMPORARY_WORKSPACE)
+
+    # 4) And start the UI thread
+    ui_thread = Thread(target=show_ui)
+    ui_thread.daemon = True
+    ui_thread.start()
+    return "ok"
+
+
+def toggle_overview():
+    return show_overview() if global_updates_running else hide_overview()
+
+
+class CommandDispatcher(Thread):
+    """Runs the control commands, from the control socket or the signals, one at a time on its own thread.
+
+    Signal handlers only enqueue their command: showing the overview takes screenshots and talks to i3,
+    which doesn't belong in signal context. Running the commands in order also means that a burst of
+    toggles (a key kept pressed) can't start an overview while the previous one is still closing.
+    """
+
+    def __init__(self):
+        super().__init__(name='dispatcher', daemon=True)
+        self.queue = queue.Queue()
+        self.handlers = {
+            'show': show_overview,
+            'hide': hide_overview,
+            'toggle': toggle_overview,
+            'reload': reload_config,
+            'stats': lambda: json.dumps(stats.snapshot()),
+            'dump': lambda: "ok: " + stats.dump(),
+        }
 
-        # 2) Get the visible workspace on the primary monitor
-        visible_ws_primary = [w.num for w in i3.get_workspaces()
-                              if w.visible == True and w.output == primary_output_name][0]
-        global_knowledge['visible_ws_primary'] = visible_ws_primary
+    def submit(self, command):
+        # Don't wait for the command to run, e.g. from a signal handler
+        self.queue.put((command, None))
+
+    def call(self, command, timeout=10):
+        # Run the command and return its reply
+        reply = {'done': Event(), 'result': "error: timed out"}
+        self.queue.put((command, reply))
+        reply['done'].wait(timeout)
+        return reply['result']
+
+    def run(self):
+        while True:
+            command, reply = self.queue.get()
+            if command in self.handlers.keys():
+                try:
+                    result = self.handlers[command]()
+                except Exception as e:
+                    result = "error: " + str(e)
+                    print("Command " + command + " failed: " + str(e))
+            else:
+                result = "error: unknown command " + repr(command)
+            if reply is not None:
+                reply['result'] = result
+                reply['done'].set()
+
+
+class ControlServer(Thread):
+    """Accepts the commands of i3expoctl on a unix socket in the XDG runtime directory.
+
+    One command per connection, as a line of text, answered with a line starting with "ok" or "error"
+    once it ran (the stats command answers with JSON). After "subscribe", the connection is kept open
+    and gets the preview export events.
+    """
+
+    def __init__(self, path):
+        super().__init__(name='control', daemon=True)
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        make_runtime_dir()
+        with suppress(FileNotFoundError):
+            os.unlink(path)  # Left behind by a previous instance
+        self.sock.bind(path)
+        os.chmod(path, 0o600)
+        self.sock.listen(8)
+
+    def run(self):
+        while True:
+            conn, _ = self.sock.accept()
+            try:
+                conn.settimeout(5)
+                command = conn.makefile('r').readline().strip()
+                if command == 'subscribe' and preview_export.enabled:
+                    conn.sendall(("ok: " + preview_export.path + "\n").encode())
+                    preview_export.subscribe(conn)
+                    continue
+                elif command == 'subscribe':
+                    conn.sendall(b"error: the preview export is disabled\n")
+                else:
+                    conn.sendall((dispatcher.call(command) + "\n").encode())
+            except OSError as e:
+                print("Control connection failed: " + str(e))
+            conn.close()
 
-        # 3) First move to the active ws on the primary output, then create a temporary workspace for the expo view
-        i3.command('workspace ' + global_knowledge["wss"][visible_ws_primary]['name'] +
-                   '; workspace i3expod-temporary-workspace')
 
-        # 4) And start the UI thread
-        ui_thread = Thread(target=show_ui)
-        ui_thread.daemon = True
-        ui_thread.start()
+dispatcher = CommandDispatcher()
+ui_thread = None
 
 
 # Bind signals
@@ -124,6 +358,7 @@ signal.signal(signal.SIGINT, signal_quit)
 signal.signal(signal.SIGTERM, signal_quit)
 signal.signal(signal.SIGHUP, signal_reload)
 signal.signal(signal.SIGUSR1, signal_show)
+signal.signal(signal.SIGUSR2, signal_stats)
 
 config = configparser.RawConfigParser()
 
@@ -163,6 +398,15 @@ def get_color(section=None, option=None, raw=None):
     raise ValueError
 
 
+class NamesPosition(Enum):
+    UNDER = "under"
+    INSIDE = "inside"
+
+
+def get_names_position(section, option):
+    return NamesPosition(str(config.get(section, option)).lower())
+
+
 defaults = {
     ('UI', 'bgcolor'): (get_color, get_color(raw='gray20')),
     ('UI', 'padding_percent_x'): (config.getint, 5),
@@ -181,27 +425,56 @@ defaults = {
     ('UI', 'names_font'): (config.get, 'sans-serif'),
     ('UI', 'names_fontsize'): (config.getint, 25),
     ('UI', 'names_color'): (get_color, get_color(raw='white')),
-    ('UI', 'names_position'): (config.get, "under"),
+    ('UI', 'names_position'): (get_names_position, "under"),
     ('UI', 'highlight_percentage'): (config.getint, 20),
+    ('UI', 'preview_max_percent'): (config.getint, 50),
+    ('UI', 'keep_window'): (config.getboolean, 'True'),
+    ('UI', 'thumbnail_cache_mb'): (config.getint, 32),
+    ('UI', 'preview_memory_mb'): (config.getint, 64),
+    ('UI', 'fade_ms'): (config.getint, 300),
+    ('UI', 'zoom_ms'): (config.getint, 0),
+    ('STATS', 'enabled'): (config.getboolean, 'False'),
+    ('EXPORT', 'enabled'): (config.getboolean, 'False'),
+    ('CAPTURE', 'settle_delay_ms'): (config.getint, 200),
+    ('CAPTURE', 'damage_max_delay_ms'): (config.getint, 1000),
+    ('CAPTURE', 'composite'): (config.getboolean, 'False'),
+    ('CAPTURE', 'persist_previews'): (config.getboolean, 'True'),
 }
 
 
 def read_config():
     config.read(os.path.join(xdg_config_home, "i3expo", "config"))
     # Read custom labels for output names (if any)
-    for key in config['OUTPUT_ALIASES']:
-        global_knowledge['out_aliases'][key] = config['OUTPUT_ALIASES'][key]
+    if config.has_section('OUTPUT_ALIASES'):
+        for key in config['OUTPUT_ALIASES']:
+            global_knowledge['out_aliases'][key] = config['OUTPUT_ALIASES'][key]
     # Read and override default config if != None
     for option in defaults.keys():
+        if not config.has_section(option[0]):
+            config.add_section(option[0])
         if not isset(option):
             if defaults[option][1] is None:
                 print("Error: Mandatory option " + str(option) + " not set!")
                 sys.exit(1)
             config.set(*option, value=defaults[option][1])
+    compile_config()
+    stats.enabled = get_config('STATS', 'enabled')
+
+
+# Every option parsed once (colors, numbers, enums), swapped as a whole on reload. Caches of anything drawn
+# from the config keep the version they were made with
+ConfigSnapshot = namedtuple('ConfigSnapshot', ['version', 'values'])
+settings = ConfigSnapshot(0, MappingProxyType({}))
+
+
+def compile_config():
+    global settings
+    values = {option: defaults[option][0](*option) for option in defaults.keys()}
+    settings = ConfigSnapshot(settings.version + 1, MappingProxyType(values))
 
 
 def get_config(*option):
-    return defaults[option][0](*option)
+    return settings.values[option]
 
 
 def isset(option):
@@ -209,87 +482,945 @@ def isset(option):
         if defaults[option][0](*option) == "None":
             return False
         return True
-    except ValueError:
+    except (ValueError, configparser.Error):
+        # Not a valid value or missing from the config file (e.g. added by an update)
         return False
 
 
-def grab_screen(x=None, y=None, w=None, h=None):
-    result = prtscn.getScreen(x, y, w, h)
-    pil = Image.frombuffer('RGB', (w, h), result, 'raw', 'RGB', 0, 1)
-    # draw = ImageDraw.Draw(pil)
-    # draw.text((100,100), 'abcde')
-    return pygame.image.fromstring(pil.tobytes(), pil.size, pil.mode)
+def grab_screen(x=None, y=None, w=None, h=None, scale=1):
+    # The capture buffer is already laid out as 32 bit pixels, so the surface
+    # can share its memory instead of copying it around
+    with stats.timer('capture'):
+        result = prtscn.getScreenBuffer(x, y, w, h, scale)
+    return pygame.image.frombuffer(result, (w // scale, h // scale), prtscn.PIXEL_FORMAT)
+
+
+def get_preview_scale(w, h):
+    # Screenshots are only ever shown as overview tiles, which are a fraction of the monitor size
+    # (there's always at least a "+" tile next to a workspace), so they are downscaled while
+    # capturing to at most preview_max_percent of the monitor rather than stored at full resolution.
+    # The smallest integer factor which fits, in integers to stay exact on the boundaries
+    max_percent = get_config('UI', 'preview_max_percent')
+    if max_percent <= 0 or max_percent >= 100:
+        return 1
+    monitor_w, monitor_h = global_knowledge['monitor_size']
+    scale = max(-(-w * 100 // (monitor_w * max_percent)), -(-h * 100 // (monitor_h * max_percent)))
+    return max(1, min(scale, w, h))
+
+
+class PreviewStore:
+    """Screenshots of the workspaces, within preview_memory_mb.
+
+    The ones of the workspaces on screen are kept as they are, since they are updated all the time (damage
+    regions are blitted into them). The others are compressed with zlib as soon as their workspace goes
+    off screen, and decompressed on demand: the thumbnail cache usually spares that. Past the budget, the
+    least recently used screenshots are dropped, their workspaces show up as unknown until captured again.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()  # workspace -> Surface, or (zlib data, size) when compressed
+        self.signatures = {}  # workspace -> signature of the screenshot as it was put
+        self.size = 0
+
+    def put(self, num, surface, compress=False, signature=None):
+        self.discard(num)
+        self.entries[num] = surface
+        self.signatures[num] = signature if signature is not None else self.signature(surface)
+        self.size += self.bytes(surface)
+        if compress:
+            self.compress(num)
+        self.evict(num)
+
+    def get(self, num, keep=False):
+        # The screenshot of a workspace, None if there isn't any. keep (a workspace back on screen) stores it
+        # uncompressed again, otherwise don't modify it: it may be the one of the store
+        entry = self.entries.get(num)
+        if entry is None:
+            return None
+        self.entries.move_to_end(num)
+        if isinstance(entry, pygame.Surface):
+            return entry
+
+        data, size = entry
+        with stats.timer('decompress'):
+            surface = pygame.image.frombuffer(bytearray(zlib.decompress(data)), size, 'RGB')
+        if keep:
+            self.put(num, surface)
+        return surface
+
+    def get_size(self, num):
+        entry = self.entries.get(num)
+        if entry is None:
+            return None
+        return entry.get_size() if isinstance(entry, pygame.Surface) else entry[1]
+
+    def has(self, num):
+        return num in self.entries.keys()
+
+    def unchanged(self, num, signature):
+        # Whether the screenshot with this signature has the same pixels as the stored one
+        return num in self.signatures.keys() and self.signatures[num] == signature
+
+    def blit(self, num, patch, position):
+        # Patch the stored screenshot of a workspace, which has to be on screen
+        self.get(num, keep=True).blit(patch, position)
+        self.signatures.pop(num, None)  # Not what was put anymore
+
+    @staticmethod
+    def signature(surface):
+        # Format and checksum of the pixels, read in place rather than copied out of the surface
+        return surface.get_size(), surface.get_bitsize(), surface.get_masks(), zlib.crc32(surface.get_buffer())
+
+    def load(self, num, data, size):
+        # A compressed screenshot, e.g. restored from the preview file
+        self.discard(num)
+        self.entries[num] = (data, size)
+        self.signatures.pop(num, None)
+        self.size += len(data)
+        self.evict(num)
+
+    def snapshot(self):
+        return list(self.entries.items())
+
+    def compress(self, num):
+        entry = self.entries.get(num)
+        if not isinstance(entry, pygame.Surface):
+            return
+        with stats.timer('compress'):
+            data = zlib.compress(pygame.image.tostring(entry, 'RGB'), 1)
+        self.entries[num] = (data, entry.get_size())
+        self.size += len(data) - self.bytes(entry)
+
+    def rename(self, old, new):
+        if old in self.entries.keys():
+            self.discard(new)
+            self.entries[new] = self.entries.pop(old)
+            if old in self.signatures.keys():
+                self.signatures[new] = self.signatures.pop(old)
+
+    def discard(self, num):
+        entry = self.entries.pop(num, None)
+        self.signatures.pop(num, None)
+        if entry is not None:
+            self.size -= self.bytes(entry)
+
+    def evict(self, keep=None):
+        limit = get_config('UI', 'preview_memory_mb') * 1024 * 1024
+        for num in [num for num in self.entries.keys() if num != keep]:
+            if self.size <= limit:
+                break
+            self.discard(num)
+            expo_frame.invalidate(num)
+            stats.count('previews_evicted')
+
+    @staticmethod
+    def bytes(entry):
+        if isinstance(entry, pygame.Surface):
+            return entry.get_width() * entry.get_height() * entry.get_bytesize()
+        return len(entry[0])
+
+
+previews = PreviewStore()
+
+
+class PreviewFile(Thread):
+    """Saves the screenshots in the XDG runtime directory, so that a restarted daemon knows the workspaces.
+
+    Saving happens in the background, at most every delay seconds. At startup the file is mapped in
+    memory: the screenshots of the workspaces which still exist, with the same name, output and size,
+    are handed to the preview store as they are (compressed), the others are ignored.
+    """
+
+    MAGIC = b'i3expo previews 1\n'
+
+    def __init__(self, path, delay=10):
+        super().__init__(name='previews', daemon=True)
+        self.path = path
+        self.delay = delay
+        self.enabled = False
+        self.dirty = False
+        self.cond = Condition()
+        self.mapping = None  # The loaded file, restored screenshots point into it
+
+    def schedule(self):
+        if not self.enabled:
+            return
+        with self.cond:
+            self.dirty = True
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.dirty:
+                    self.cond.wait()
+            time.sleep(self.delay)  # Let the screenshots of a burst of changes pile up
+            with self.cond:
+                self.dirty = False
+            self.save()
+
+    def save(self):
+        # Take the screenshots as they are now, compress the uncompressed ones outside of the lock
+        with state_lock:
+            entries = []
+            for num, entry in previews.snapshot():
+                info = global_knowledge['wss'].get(num)
+                if info is None:
+                    continue
+                if isinstance(entry, pygame.Surface):
+                    entry = entry.copy()
+                entries.append((info['name'], info['output'], info['size'], info['scale'], entry))
+
+        index = []
+        blobs = []
+        offset = 0
+        for name, output, size, scale, entry in entries:
+            if isinstance(entry, pygame.Surface):
+                data, shape = zlib.compress(pygame.image.tostring(entry, 'RGB'), 1), entry.get_size()
+            else:
+                data, shape = entry
+            index.append({'name': name, 'output': output, 'size': list(size), 'scale': scale,
+                          'shape': list(shape), 'offset': offset, 'length': len(data), 'crc': zlib.crc32(data)})
+            blobs.append(data)
+            offset += len(data)
+        header = json.dumps(index).encode()
 
+        try:
+            make_runtime_dir()
+            tmp_path = self.path + ".tmp"
+            with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+                f.write(self.MAGIC + struct.pack('<I', len(header)) + header)
+                for data in blobs:
+                    f.write(data)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print("Could not save the screenshots: " + str(e))
+
+    def load(self):
+        # Restore the screenshots of the current workspaces, returns how many of them were
+        try:
+            with open(self.path, 'rb') as f:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return 0  # No file (or an empty one)
 
-def update_workspace(workspace, screenshot=None):
-    if workspace.num not in global_knowledge["wss"].keys():
-        global_knowledge["wss"][workspace.num] = {
+        try:
+            if mapping[:len(self.MAGIC)] != self.MAGIC:
+                return 0
+            start = len(self.MAGIC) + 4
+            header_length = struct.unpack('<I', mapping[len(self.MAGIC):start])[0]
+            index = json.loads(mapping[start:start + header_length].decode())
+        except (struct.error, ValueError):
+            print("Ignoring the invalid screenshots file " + self.path)
+            return 0
+        blobs = memoryview(mapping)[start + header_length:]
+
+        restored = 0
+        with state_lock:
+            current = {(ws['name'], ws['output']): ws for ws in workspace_model.get_workspaces()}
+            for entry in index:
+                ws = current.get((entry.get('name'), entry.get('output')))
+                if ws is None or previews.has(ws['num']):
+                    continue
+                w, h = ws['rect'][2:]
+                scale = get_preview_scale(w, h)
+                # Same size and scale as it would be captured now, and not damaged
+                data = blobs[entry['offset']:entry['offset'] + entry['length']]
+                if entry['size'] != [w, h] or entry['scale'] != scale or \
+                        entry['shape'] != [w // scale, h // scale] or \
+                        len(data) != entry['length'] or zlib.crc32(data) != entry['crc']:
+                    continue
+                previews.load(ws['num'], data, (w // scale, h // scale))
+                info = global_knowledge['wss'][ws['num']]
+                info['scale'] = scale
+                info['generation'] = next(screenshot_generation)
+                expo_frame.invalidate(ws['num'])
+                restored += 1
+
+        self.mapping = mapping
+        stats.count('previews_restored', restored)
+        return restored
+
+
+preview_file = PreviewFile(runtime_path("previews"))
+
+
+class PreviewExport(Thread):
+    """Publishes the screenshots for other tools (bars, launchers...), so that they don't capture the screen too.
+
+    Each workspace gets a file in the XDG runtime directory (a tmpfs, i.e. shared memory), to be mmapped:
+    a header (HEADER: magic, version, header size, generation, width, height, stride, format) followed by
+    the pixels. A new screenshot replaces the file, so a reader keeps a consistent image for as long as it
+    has the old one mapped. The clients subscribed on the control socket get a line of JSON per change.
+    """
+
+    MAGIC = b'I3XP'
+    HEADER = struct.Struct('<4sHHQIII4s')
+
+    def __init__(self, path):
+        super().__init__(name='export', daemon=True)
+        self.path = path
+        self.enabled = False
+        self.pending = set()
+        self.subscribers = []
+        self.cond = Condition()
+
+    def file_path(self, num):
+        return os.path.join(self.path, str(num))
+
+    def publish(self, num):
+        # The screenshot of a workspace changed, or the workspace is gone
+        if not self.enabled:
+            return
+        with self.cond:
+            self.pending.add(num)
+            self.cond.notify()
+
+    def subscribe(self, conn):
+        conn.settimeout(1)
+        with self.cond:
+            self.subscribers.append(conn)
+
+    def start(self):
+        # Start from an empty directory, the files of a previous instance may be outdated
+        make_runtime_dir()
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+        for name in os.listdir(self.path):
+            with suppress(OSError):
+                os.unlink(os.path.join(self.path, name))
+        self.enabled = True
+        with state_lock:
+            for num in global_knowledge['wss'].keys():
+                self.publish(num)
+        super().start()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                pending = self.pending
+                self.pending = set()
+            for num in sorted(pending):
+                event = self.export(num)
+                if event is not None:
+                    self.notify(event)
+
+    def export(self, num):
+        # Write the screenshot of a workspace, returns the event to send (None if there's nothing new)
+        with state_lock:
+            info = global_knowledge['wss'].get(num)
+            if info is None:
+                with suppress(FileNotFoundError):
+                    os.unlink(self.file_path(num))
+                    return {'event': 'removed', 'num': num}
+                return None
+            screenshot = previews.get(num)
+            if screenshot is None:
+                return None  # Dropped from memory, the last exported one is still right
+            pixels = pygame.image.tostring(screenshot, prtscn.PIXEL_FORMAT)
+            w, h = screenshot.get_size()
+            generation = info['generation']
+            event = {'event': 'preview', 'num': num, 'name': info['name'], 'output': info['output'],
+                     'generation': generation, 'width': w, 'height': h, 'format': prtscn.PIXEL_FORMAT,
+                     'path': self.file_path(num)}
+
+        header = self.HEADER.pack(self.MAGIC, 1, self.HEADER.size, generation, w, h, w * 4,
+                                  prtscn.PIXEL_FORMAT.encode())
+        tmp_path = self.file_path(num) + ".tmp"
+        try:
+            with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+                f.write(header)
+                f.write(pixels)
+            os.replace(tmp_path, self.file_path(num))
+        except OSError as e:
+            print("Could not export the screenshot of workspace " + str(num) + ": " + str(e))
+            return None
+        stats.count('exported_previews')
+        return event
+
+    def notify(self, event):
+        line = (json.dumps(event) + "\n").encode()
+        with self.cond:
+            subscribers = list(self.subscribers)
+        for conn in subscribers:
+            try:
+                conn.sendall(line)
+            except OSError:
+                # Gone (or not reading): drop it
+                with self.cond:
+                    self.subscribers.remove(conn)
+                conn.close()
+
+
+preview_export = PreviewExport(runtime_path("export"))
+
+
+def update_workspace(workspace, screenshot=None, scale=1):
+    # workspace is a WorkspaceModel entry. Without a screenshot only the workspace properties are updated
+    num = workspace['num']
+    if num not in global_knowledge["wss"].keys():
+        global_knowledge["wss"][num] = {
             'name': None,
-            'screenshot': None,
+            'scale': 1,
+            'generation': 0,
             'windows': {},
+            'origin': (0, 0),
             'size': (0, 0),
             'output': "",
             'focused_win_screenshot': None,
             'focused_win_size': None
         }
 
-    global_knowledge["wss"][workspace.num]['size'] = (workspace.rect.width, workspace.rect.height)
-    global_knowledge["wss"][workspace.num]['name'] = workspace.name
-    global_knowledge["wss"][workspace.num]['screenshot'] = screenshot
-    if hasattr(workspace, 'ipc_data') and 'output' in workspace.ipc_data.keys():
-        global_knowledge["wss"][workspace.num]['output'] = workspace.ipc_data['output']
-
-    global_knowledge["active"] = workspace.num
+    global_knowledge["wss"][num]['origin'] = workspace['rect'][:2]
+    global_knowledge["wss"][num]['size'] = workspace['rect'][2:]
+    global_knowledge["wss"][num]['name'] = workspace['name']
+    global_knowledge["wss"][num]['output'] = workspace['output']
+    signature = previews.signature(screenshot) if screenshot is not None else None
+    if screenshot is not None and global_knowledge["wss"][num]['scale'] == scale and \
+            previews.unchanged(num, signature):
+        # Same as before: keep the generation, so that its thumbnail isn't scaled again
+        stats.count('captures_unchanged')
+        if workspace['visible']:
+            previews.put(num, screenshot, signature=signature)  # Uncompressed again, it's on screen
+    elif screenshot is not None:
+        previews.put(num, screenshot, compress=not workspace['visible'], signature=signature)
+        global_knowledge["wss"][num]['scale'] = scale
+        global_knowledge["wss"][num]['generation'] = next(screenshot_generation)
+        preview_file.schedule()
+        preview_export.publish(num)
+    elif not workspace['visible']:
+        previews.compress(num)  # Won't change until it's back on screen
+    expo_frame.invalidate(num)
+
+    if workspace['focused']:
+        global_knowledge["active"] = num
 
 
 def init_knowledge():
-    root = i3.get_tree()
-    for workspace in root.workspaces():
-        update_workspace(workspace)
-    # all outputs but the virtual ones
-    global_knowledge["outputs"] = [o for o in i3.get_outputs() if o.name.find('xroot') < 0]
+    global_knowledge['monitor_size'] = (pygame.display.Info().current_w, pygame.display.Info().current_h)
+    workspace_model.sync()
+
+
+class WorkspaceModel:
+    """Workspaces and outputs as i3 sees them.
+
+    It's filled with get_workspaces/get_outputs and then kept up to date from the workspace and output
+    events, instead of fetching (and parsing) the whole layout tree for every capture. It's synced again
+    only when an event doesn't tell enough about the change (moves, outputs), or after i3 restarted.
+    Every change is mirrored on the workspaces of global_knowledge.
+    """
+
+    def __init__(self):
+        # Same lock as global_knowledge, which is updated together with the model
+        self.lock = state_lock
+        self.workspaces = {}  # con id -> {'id', 'num', 'name', 'output', 'rect', 'visible', 'focused'}
+        self.outputs = []
+        self.stale = True
+        self.removals_deferred = False
+
+    def sync(self):
+        with stats.timer('sync'):
+            workspaces = i3.get_workspaces()
+            # all outputs but the virtual ones
+            outputs = [o for o in i3.get_outputs() if o.name.find('xroot') < 0]
+        with self.lock:
+            self.workspaces = {}
+            for w in workspaces:
+                if w.name == TEMPORARY_WORKSPACE:
+                    continue
+                ws = {'id': w.ipc_data.get('id', w.name), 'num': w.num, 'name': w.name, 'output': w.output,
+                      'rect': (w.rect.x, w.rect.y, w.rect.width, w.rect.height),
+                      'visible': w.visible, 'focused': w.focused}
+                self.workspaces[ws['id']] = ws
+                update_workspace(ws)
+            self.outputs = outputs
+            self.stale = False
+
+            self.remove_leftovers()
+
+    def remove_leftovers(self):
+        # Drop the workspaces i3 doesn't have anymore. Not while the overview is shown: it still uses them
+        # (e.g. the one it was opened from, which i3 removes once it's left empty), until it's closed
+        with self.lock:
+            if not global_updates_running:
+                self.removals_deferred = True
+                return
+            self.removals_deferred = False
+            nums = [ws['num'] for ws in self.workspaces.values()]
+            for num in [num for num in global_knowledge["wss"].keys() if num not in nums]:
+                del global_knowledge["wss"][num]
+                previews.discard(num)
+                preview_export.publish(num)
+
+    def overview_closed(self):
+        # Catch up with the removals held back while the overview was shown, at the next sync
+        if self.removals_deferred:
+            self.stale = True
+
+    def ensure_synced(self):
+        if self.stale:
+            self.sync()
+
+    def focused(self):
+        self.ensure_synced()
+        with self.lock:
+            return next((ws.copy() for ws in self.workspaces.values() if ws['focused']), None)
+
+    def get(self, num):
+        self.ensure_synced()
+        with self.lock:
+            return next((ws.copy() for ws in self.workspaces.values() if ws['num'] == num), None)
+
+    def get_workspaces(self):
+        self.ensure_synced()
+        with self.lock:
+            return [ws.copy() for ws in self.workspaces.values()]
+
+    def get_outputs(self):
+        self.ensure_synced()
+        with self.lock:
+            return list(self.outputs)
+
+    def primary_output_name(self):
+        # The primary output or, if none is (e.g. primary is on a disconnected output), the first one
+        outputs = [o for o in self.get_outputs() if o.active]
+        primary = next((o for o in outputs if o.primary), outputs[0] if outputs else None)
+        return primary.name if primary is not None else None
+
+    def on_workspace(self, i3, e):
+        if e.current is not None and e.current.name == TEMPORARY_WORKSPACE:
+            # The overview's own: the workspaces stay as they were when it was opened
+            return
+        if self.stale or e.current is None or e.change not in ('init', 'empty', 'focus', 'rename'):
+            # move, reload, restore... don't carry enough to be applied (e.g. the new rects)
+            if e.change != 'urgent':
+                self.sync()
+            return
+
+        con = e.current
+        with self.lock:
+            if e.change == 'empty':
+                if self.workspaces.pop(con.id, None) is not None:
+                    self.remove_leftovers()
+                return
+
+            ws = self.workspaces.get(con.id)
+            if ws is None:
+                if 'output' not in con.ipc_data.keys():
+                    self.sync()
+                    return
+                ws = {'id': con.id, 'num': con.num, 'name': con.name, 'output': con.ipc_data['output'],
+                      'rect': (con.rect.x, con.rect.y, con.rect.width, con.rect.height),
+                      'visible': False, 'focused': False}
+                self.workspaces[con.id] = ws
+            elif e.change == 'rename':
+                if ws['num'] != con.num and ws['num'] in global_knowledge["wss"].keys():
+                    global_knowledge["wss"][con.num] = global_knowledge["wss"].pop(ws['num'])
+                    previews.rename(ws['num'], con.num)
+                    preview_export.publish(ws['num'])
+                    preview_export.publish(con.num)
+                ws['num'] = con.num
+                ws['name'] = con.name
+
+            # i3 sends init before the workspace is laid out (a 0x0 rect): take the rect from the events
+            # which have one, and ask i3 for it at the next use otherwise
+            if con.rect.width > 0 and con.rect.height > 0:
+                ws['rect'] = (con.rect.x, con.rect.y, con.rect.width, con.rect.height)
+            elif ws['rect'][2] <= 0 or ws['rect'][3] <= 0:
+                self.stale = True
+
+            if e.change == 'focus':
+                for w in self.workspaces.values():
+                    w['focused'] = False
+                    if w['output'] == ws['output'] and w['visible'] and w is not ws:
+                        # Off screen now: its screenshot can be compressed
+                        w['visible'] = False
+                        update_workspace(w)
+                ws['focused'] = ws['visible'] = True
+
+            update_workspace(ws)
+
+    def on_output(self, i3, e):
+        self.sync()
+
+    def on_shutdown(self, i3, e):
+        # i3 is restarting: the connection reconnects by itself, sync again once it's needed
+        self.stale = True
+
+
+workspace_model = WorkspaceModel()
+
+
+class CaptureWorker(Thread):
+    """Takes the screenshots on its own thread, so that the i3 event handlers only have to enqueue a request.
+
+    Requests are keyed by workspace (None stands for "the focused one") and debounced on the trailing edge:
+    every request for a workspace moves its capture settle_delay_ms into the future, so a burst of events
+    results in a single screenshot taken once the burst is over. When more than maxsize workspaces are
+    waiting the oldest request is dropped.
+
+    A request can be limited to a region of the workspace, pending regions of a workspace are merged.
+    Sources which may never settle (e.g. the damage of a playing video) pass max_delay, which bounds how
+    long the capture can be pushed back by newer requests.
+    """
+
+    def __init__(self, maxsize=32):
+        super().__init__(name='capture', daemon=True)
+        self.maxsize = maxsize
+        self.pending = OrderedDict()  # workspace -> {'due', 'deadline', 'region'}
+        self.cond = Condition()
+
+    def request(self, ws=None, delay=None, region=None, max_delay=None):
+        if delay is None:
+            delay = get_config('CAPTURE', 'settle_delay_ms') / 1000
+        with self.cond:
+            now = time.monotonic()
+            deadline = now + max_delay if max_delay is not None else math.inf
+            old = self.pending.pop(ws, None)
+            if old is not None:
+                stats.count('captures_coalesced')
+                deadline = min(deadline, old['deadline'])
+                # A region only stays a region if both requests are
+                region = union_rect(old['region'], region) if old['region'] and region else None
+            self.pending[ws] = {'due': min(now + delay, deadline), 'deadline': deadline, 'region': region}
+            while len(self.pending) > self.maxsize:
+                self.pending.popitem(last=False)
+                stats.count('captures_dropped')
+            self.cond.notify()
+
+    def postpone(self, delay=None):
+        # Push back every pending capture, e.g. while the compositor is fading between workspaces
+        if delay is None:
+            delay = get_config('CAPTURE', 'settle_delay_ms') / 1000
+        with self.cond:
+            due = time.monotonic() + delay
+            for req in self.pending.values():
+                req['due'] = max(req['due'], due)
+            self.cond.notify()
+
+    def next_due(self):
+        # Wait until at least one request settled and return all the settled ones as (workspace, region)
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                due = [ws for ws, req in self.pending.items() if req['due'] <= now]
+                if due:
+                    return [(ws, self.pending.pop(ws)['region']) for ws in due]
+                self.cond.wait(min(req['due'] for req in self.pending.values()) - now if self.pending else None)
+
+    def take_pending(self):
+        # Every waiting request, settled or not, as (workspace, region)
+        with self.cond:
+            batch = list(self.pending.items())
+            self.pending.clear()
+        return [(ws, req['region']) for ws, req in batch]
+
+    def capture(self, batch):
+        # With XComposite, the windows are looked up in a single tree for the whole batch
+        tree = None
+        if window_pixmaps.enabled and any(region is None for ws, region in batch):
+            try:
+                with stats.timer('tree'):
+                    tree = i3.get_tree()
+            except Exception as e:
+                print("Could not get the tree: " + str(e))
+
+        captured = set()
+        for ws, region in batch:
+            if ws is None:
+                # Looked up here rather than by the event handlers, which mustn't wait for state_lock
+                focused = workspace_model.focused()
+                ws = focused['num'] if focused is not None else None
+            if ws in captured:
+                continue  # Already taken along with another workspace on screen
+            try:
+                if region is None:
+                    captured |= update_state(ws, tree)
+                else:
+                    update_region(ws, region)
+            except Exception as e:
+                print("Capture of workspace " + str(ws) + " failed: " + str(e))
+
+        # Windows may have been opened, moved or closed: take hold of the contents of the ones on screen
+        if tree is not None:
+            try:
+                window_pixmaps.refresh(tree)
+            except Exception as e:
+                print("Refresh of the window pixmaps failed: " + str(e))
+
+    def run(self):
+        while True:
+            self.capture(self.next_due())
+
+            # Keep the overview warm, so that it's ready to be shown
+            with state_lock:
+                if global_updates_running:
+                    expo_frame.refresh()
+
+
+def visible_windows(con):
+    # Window containers of con as they are stacked on screen, bottom to top: only the focused child of
+    # tabbed/stacked containers, floating windows over the tiling ones
+    if con.window:
+        return [con]
+    children = con.nodes
+    if con.layout in ('tabbed', 'stacked') and children:
+        children = [c for c in children if con.focus and c.id == con.focus[0]] or children[:1]
+    windows = [w for c in children for w in visible_windows(c)]
+    for c in con.floating_nodes:
+        windows += visible_windows(c)
+    return windows
+
+
+def workspace_windows(workspace_con):
+    fullscreen = [c for c in workspace_con if c.type == 'con' and c.fullscreen_mode == 1]
+    return visible_windows(fullscreen[0] if fullscreen else workspace_con)
+
+
+class WindowPixmaps:
+    """Contents of the windows, kept with XComposite to make screenshots of workspaces which aren't on screen.
+
+    i3 unmaps the windows of hidden workspaces, and an unmapped window has no contents anymore: so the
+    pixmaps of the windows are named (referenced) while they are on screen, every time the capture worker
+    handled window or workspace events. A named pixmap keeps the last contents of the window after it's
+    unmapped. The screenshot of a hidden workspace is then composed from the pixmaps of its windows, at
+    the places they have in the tree, over its previous screenshot. Workspaces which weren't on screen
+    since the daemon started can't be composed, nor can the ones with windows resized since.
+
+    The pixmaps are full size and live in the X server: the ones of a hidden workspace are released once
+    it's been composed (or couldn't be), its windows don't change until it's back on screen anyway.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.pixmaps = {}  # X window id -> (pixmap, x, y, w, h) of its frame
+        # Captures run on the capture worker and on show_overview: a pixmap isn't freed while it's read
+        self.lock = Lock()
+
+    def start(self):
+        self.enabled = prtscn.compositeStart()
+        return self.enabled
+
+    def refresh(self, tree):
+        visible = {ws['num'] for ws in workspace_model.get_workspaces() if ws['visible']}
+        with self.lock:
+            existing = set()
+            for workspace_con in tree.workspaces():
+                existing.update(c.window for c in workspace_con if c.window)
+                if workspace_con.num not in visible:
+                    continue
+                # A new pixmap for every window on screen: the old one is stale if the window was resized
+                for con in workspace_windows(workspace_con):
+                    named = prtscn.nameWindowPixmap(con.window)
+                    if named is not None:
+                        self.release(con.window)
+                        self.pixmaps[con.window] = named
+
+            for window in [w for w in self.pixmaps.keys() if w not in existing]:
+                self.release(window)
+
+    def release(self, window):
+        old = self.pixmaps.pop(window, None)
+        if old is not None:
+            prtscn.freePixmap(old[0])
+
+    def compose(self, workspace, tree=None):
+        # Screenshot of a hidden workspace (a WorkspaceModel entry) from the pixmaps of its windows, as
+        # they are in tree (the current one by default)
+        if tree is None:
+            tree = i3.get_tree()
+        workspace_con = next((w for w in tree.workspaces() if w.num == workspace['num']), None)
+        if workspace_con is None:
+            return False
+        windows = workspace_windows(workspace_con)
+
+        x, y, w, h = workspace['rect']
+        scale = get_preview_scale(w, h)
+        with state_lock:
+            info = global_knowledge['wss'].get(workspace['num'])
+            if info is not None and info['scale'] == scale and \
+                    previews.get_size(workspace['num']) == (w // scale, h // scale):
+                screenshot = previews.get(workspace['num']).copy()  # Keeps the wallpaper between the windows
+            else:
+                screenshot = pygame.Surface((w // scale, h // scale))
+
+        with self.lock:
+            try:
+                # Every window has to be there, as big as it is now, or the screenshot would be wrong
+                if not windows or any(con.window not in self.pixmaps.keys() or
+                                      self.pixmaps[con.window][3:] != (con.rect.width, con.rect.height)
+                                      for con in windows):
+                    stats.count('captures_skipped')
+                    return False
+                with stats.timer('compose'):
+                    for con in windows:
+                        pixmap, px, py, pw, ph = self.pixmaps[con.window]
+                        if pw < scale or ph < scale:
+                            continue
+                        buf = prtscn.getPixmapBuffer(pixmap, pw, ph, scale)
+                        image = pygame.image.frombuffer(buf, (pw // scale, ph // scale), prtscn.PIXEL_FORMAT)
+                        screenshot.blit(image, ((px - x) // scale, (py - y) // scale))
+            finally:
+                # Named again when the workspace is back on screen
+                for con in windows:
+                    self.release(con.window)
+
+        with state_lock:
+            # Not published if the workspace came back on screen (or the overview opened) meanwhile
+            current = workspace_model.get(workspace['num'])
+            if not global_updates_running or current is None or current['visible'] or \
+                    current['rect'] != workspace['rect']:
+                stats.count('captures_skipped')
+                return False
+            update_workspace(current, screenshot, scale)
+        stats.count('composed_captures')
+        return True
+
+
+window_pixmaps = WindowPixmaps()
+
+
+class DamageMonitor(Thread):
+    """Follows the XDamage reports of the root window and schedules captures of the damaged parts of the
+    workspaces on screen, so that their screenshots stay current (videos, terminals...) without polling."""
+
+    def __init__(self):
+        super().__init__(name='damage', daemon=True)
+
+    def run(self):
+        fd = prtscn.connectionNumber()
+        while True:
+            # Wake up now and then even if the connection isn't readable: the capture replies may have
+            # pulled the damage notifications into Xlib's queue already
+            select.select([fd], [], [], 0.5)
+            rects = prtscn.getDamage()
+            if not rects or not global_updates_running:
+                continue
+
+            for workspace in workspace_model.get_workspaces():
+                if not workspace['visible']:
+                    continue
+                region = None
+                for rect in rects:
+                    rect = intersect_rect(rect, workspace['rect'])
+                    if rect is not None:
+                        region = union_rect(region, rect) if region else rect
+                if region is not None:
+                    capture_worker.request(workspace['num'], region=region,
+                                           max_delay=get_config('CAPTURE', 'damage_max_delay_ms') / 1000)
 
 
-def update_state(i3, e):
-    global last_update
+capture_worker = CaptureWorker()
+damage_monitor = DamageMonitor()
 
-    time_delta = time.time() - last_update
 
+def schedule_update(i3, e):
+    # i3 event handler: never block the IPC thread (not even on state_lock), let the capture worker do the job
+    capture_worker.request()
+
+
+def update_state(ws=None, tree=None):
+    # Take a screenshot of a workspace (the focused one by default), as long as it's on screen. The ones
+    # on the other outputs are on screen too, so they are captured at the same time.
+    # The grabs don't hold state_lock (nor the GIL): it's only taken to publish them, so that the overview
+    # and the i3 events aren't kept waiting behind a capture. Returns the workspaces captured
     if not global_updates_running:
+        return set()
+
+    current_workspace = workspace_model.focused() if ws is None else workspace_model.get(ws)
+    if current_workspace is not None and not current_workspace['visible'] and window_pixmaps.enabled:
+        # Off screen, but the contents of its windows may have been kept
+        return {current_workspace['num']} if window_pixmaps.compose(current_workspace, tree) else set()
+    if current_workspace is None or not current_workspace['visible']:
+        stats.count('captures_skipped')
+        return set()
+
+    # One request per output rather than one for their bounding box, which can be mostly off screen
+    # (e.g. outputs of different sizes): the shared memory segment of the first one is reused
+    captured = set()
+    for workspace in workspace_model.get_workspaces():
+        x, y, w, h = workspace['rect']
+        if not workspace['visible'] or w <= 0 or h <= 0:
+            continue  # Not on screen, or not laid out yet
+        # A failing output doesn't keep the others from being captured
+        try:
+            scale = get_preview_scale(w, h)
+            screenshot = grab_screen(x=x, y=y, w=w, h=h, scale=scale)
+        except Exception as e:
+            print("Capture of workspace " + str(workspace['num']) + " failed: " + str(e))
+            continue
+        with state_lock:
+            # The overview may have been opened, or the workspace switched away from, during the grab
+            current = workspace_model.get(workspace['num'])
+            if not global_updates_running or current is None or not current['visible'] or \
+                    current['rect'] != workspace['rect']:
+                stats.count('captures_skipped')
+                continue
+            update_workspace(current, screenshot, scale)
+        stats.count('captures')
+        captured.add(workspace['num'])
+    return captured
+
+
+def update_region(ws, region):
+    # Refresh only the given region (x, y, w, h in screen coordinates) of the screenshot of a workspace
+    with state_lock:
+        if not global_updates_running or ws not in global_knowledge['wss'].keys() or not previews.has(ws):
+            return False
+        info = global_knowledge['wss'][ws]
+        origin, size, scale = info['origin'], info['size'], info['scale']
+
+    # The damage could be the one of switching away from this workspace: only patch it if it's still the
+    # one on screen
+    current = workspace_model.get(ws)
+    if current is None or not current['visible'] or current['rect'] != origin + size:
         return False
-    if time_delta < 0.2:  # This should be >= your compositor fade time
+
+    # Align the region on the downscaling grid of the stored screenshot
+    x, y, w, h = region
+    x0 = (x - origin[0]) // scale * scale
+    y0 = (y - origin[1]) // scale * scale
+    x1 = min(math.ceil((x + w - origin[0]) / scale) * scale, size[0] // scale * scale)
+    y1 = min(math.ceil((y + h - origin[1]) / scale) * scale, size[1] // scale * scale)
+    if x1 <= x0 or y1 <= y0:
         return False
 
-    root = i3.get_tree()
-    window = root.find_focused()
-    current_workspace = window.workspace()
+    patch = grab_screen(x=origin[0] + x0, y=origin[1] + y0, w=x1 - x0, h=y1 - y0, scale=scale)
+    with state_lock:
+        # Same checks again: the screenshot may have been replaced (or the overview opened) meanwhile
+        info = global_knowledge['wss'].get(ws)
+        current = workspace_model.get(ws)
+        if not global_updates_running or info is None or not previews.has(ws) or \
+                (info['origin'], info['size'], info['scale']) != (origin, size, scale) or \
+                current is None or not current['visible'] or current['rect'] != origin + size:
+            return False
+        previews.blit(ws, patch, (x0 // scale, y0 // scale))
+        info['generation'] = next(screenshot_generation)
+        expo_frame.invalidate(ws)
+        preview_export.publish(ws)
+        stats.count('region_captures')
+        return True
+
 
-    # Remove leftover desktops
-    i3_active_wss = root.workspaces()
-    deleted = []
-    for num in global_knowledge["wss"].keys():
-        if num not in [w.num for w in i3_active_wss]:
-            deleted.append(num)
-    deleted.sort()  # make sure we're deleting the right items while iterating
-    deleted.reverse()
-    for num in deleted:
-        del (global_knowledge["wss"][num])
+def intersect_rect(a, b):
+    # (x, y, w, h) rectangles, None if they don't overlap
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[0] + a[2], b[0] + b[2]), min(a[1] + a[3], b[1] + b[3])
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return x0, y0, x1 - x0, y1 - y0
 
-    # Take a screenshot and update the active workspace
-    screenshot = grab_screen(x=current_workspace.rect.x, y=current_workspace.rect.y,
-                             w=current_workspace.rect.width, h=current_workspace.rect.height)
-    update_workspace(current_workspace, screenshot)
 
-    # Make sure this function isn't called too frequently
-    reset_update_timer(i3, e)
+def union_rect(a, b):
+    # Bounding box of two (x, y, w, h) rectangles
+    x0, y0 = min(a[0], b[0]), min(a[1], b[1])
+    x1, y1 = max(a[0] + a[2], b[0] + b[2]), max(a[1] + a[3], b[1] + b[3])
+    return x0, y0, x1 - x0, y1 - y0
 
 
-def get_hovered_frame(mpos, frames):
-    for frame in frames.keys():
-        if frames[frame]['ul'][0] < mpos[0] < frames[frame]['br'][0] \
-                and frames[frame]['ul'][1] < mpos[1] < frames[frame]['br'][1]:
-            return frame
-    return None
+def frame_rect(frame):
+    return pygame.Rect(frame['ul'], (frame['br'][0] - frame['ul'][0], frame['br'][1] - frame['ul'][1]))
 
 
 def gen_active_win_overlay(rectangle, alpha=255):
@@ -303,306 +1434,514 @@ def gen_active_win_overlay(rectangle, alpha=255):
     return lightmask, lightmask_position
 
 
-def show_ui():
-    global global_updates_running
+def render_cache(name):
+    # A cache of ui_cache, emptied when the config changes
+    cached = global_knowledge['ui_cache'].get(name)
+    if cached is None or cached[0] != settings.version:
+        cached = (settings.version, {})
+        global_knowledge['ui_cache'][name] = cached
+    return cached[1]
+
+
+def get_font(name, size):
+    # Looking a font up goes through fontconfig: resolve each of them once, until the config is reloaded
+    fonts = render_cache('fonts')
+    if (name, size) not in fonts.keys():
+        fonts[(name, size)] = pygame.font.SysFont(name, size)
+    return fonts[(name, size)]
+
+
+def render_caption(text):
+    # Label of a tile, as rendered with the current names_* options
+    font = get_config('UI', 'names_font')
+    fontsize = get_config('UI', 'names_fontsize')
+    color = get_config('UI', 'names_color')
+    position = get_config('UI', 'names_position')
+
+    captions = render_cache('captions')
+    if text in captions.keys():
+        stats.count('caption_cache_hits')
+        return captions[text]
+    stats.count('caption_cache_misses')
+
+    caption = get_font(font, fontsize).render(text, True, color)
+    if position == NamesPosition.INSIDE:
+        name_size = caption.get_size()
+        name_bg_margin_x = 8
+        name_bg_margin_y = 8
+        name_size = (name_size[0] + name_bg_margin_x, name_size[1] + name_bg_margin_y)
+        name_bg = pygame.Surface(name_size)
+        name_bg.fill((0, 0, 0))
+        name_bg.blit(caption, (name_bg_margin_x / 2, name_bg_margin_x / 2))
+        caption = name_bg
+
+    # Workspace names come and go (renames), don't keep the old ones forever
+    if len(captions) >= 256:
+        captions.clear()
+    captions[text] = caption
+    return caption
+
+
+def cached_image_path(slot, *key):
+    # File of the processed image for key (everything it was made from) in the XDG cache. There's only
+    # one image per slot: storing a new one removes the others (older sizes, wallpapers...)
+    digest = hashlib.sha1(repr((slot,) + key).encode()).hexdigest()
+    return os.path.join(xdg_cache_home, "i3expo", slot + "-" + digest + ".rgba")
+
+
+def load_cached_image(path, size):
+    # The image as stored by store_cached_image, None if it isn't there (or isn't usable)
+    try:
+        with open(path, 'rb') as f:
+            data = bytearray(f.read())
+    except OSError:
+        return None
+    if len(data) != size[0] * size[1] * 4:
+        return None
+    return pygame.image.frombuffer(data, size, 'RGBA')
 
-    FPS = 60
 
-    clock = pygame.time.Clock()
+def store_cached_image(path, image):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(pygame.image.tostring(image, 'RGBA'))
+        os.replace(tmp_path, path)  # Never leave a truncated image behind
+    except OSError as e:
+        print("Could not cache " + path + ": " + str(e))
+        return
+
+    directory, name = os.path.split(path)
+    slot = name.split("-", 1)[0]
+    for other in os.listdir(directory):
+        # The other images of the slot
+        if other.startswith(slot + "-") and other.endswith(".rgba") and other != name:
+            with suppress(OSError):
+                os.unlink(os.path.join(directory, other))
+
+
+def process_wallpaper(path, size):
+    im = Image.open(path)
+    en = ImageEnhance.Brightness(im)
+    wp_img = en.enhance(0.4)
+    wp_img = wp_img \
+        .resize((size[0], size[1]), Image.NEAREST) \
+        .filter(ImageFilter.GaussianBlur(radius=20))
+    return pygame.image.fromstring(wp_img.tobytes(), wp_img.size, wp_img.mode)
+
+
+def get_placeholders(monitor_size):
+    # The ? and + thumbnails, and their thumbnail cache generation. They are only drawn again when
+    # the monitor size or the wallpaper changed: the blurred wallpaper in particular is slow to make,
+    # so both are kept in the XDG cache across restarts
+    monitor_size = tuple(monitor_size)
+    wp_mtime = None
+    if args.wp is not None:
+        with suppress(OSError):
+            wp_mtime = os.stat(args.wp).st_mtime_ns
+    key = (monitor_size, args.wp, wp_mtime)
+
+    cached = global_knowledge['ui_cache'].get('placeholders')
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    # Everything the images are made of: the source, its processing and the size
+    missing_path = cached_image_path('missing', monitor_size, 'sans-serif', 550, (150, 150, 150))
+    new_path = cached_image_path('new', monitor_size, 'sans-serif', 550, (200, 200, 200),
+                                 args.wp, wp_mtime, 'brightness', 0.4, 'blur', 20)
+    thumb_missing = load_cached_image(missing_path, monitor_size)
+    thumb_new = load_cached_image(new_path, monitor_size)
+
+    if thumb_missing is None or thumb_new is None:
+        stats.count('placeholder_cache_misses')
+        thumb_missing = pygame.Surface((monitor_size[0], monitor_size[1]), pygame.SRCALPHA, 32)
+        thumb_new = thumb_missing.copy()
+        qm = get_font('sans-serif', 550).render('?', True, (150, 150, 150))
+        plss = get_font('sans-serif', 550).render('+', True, (200, 200, 200))
+        qm_size = qm.get_rect().size
+        origin_x = round((monitor_size[0] - qm_size[0]) / 2)
+        origin_y = round((monitor_size[1] - qm_size[1]) / 2)
+        thumb_missing.blit(qm, (origin_x, origin_y))
+
+        # if a wallpaper was specified, use that as a background for thumb_new
+        if wp_mtime is not None:
+            thumb_new.blit(process_wallpaper(args.wp, monitor_size), (0, 0))
+
+        thumb_new.blit(plss, (origin_x, origin_y))  # Then draw the + sign
+
+        store_cached_image(missing_path, thumb_missing)
+        store_cached_image(new_path, thumb_new)
+    else:
+        stats.count('placeholder_cache_hits')
 
-    workspaces = global_knowledge["wss"]
-    outputs = global_knowledge["outputs"]
+    placeholders = (thumb_missing, thumb_new, next(screenshot_generation))
+    global_knowledge['ui_cache']['placeholders'] = (key, placeholders)
+    return placeholders
 
-    # Get monitor size
-    monitor_size = (pygame.display.Info().current_w, pygame.display.Info().current_h)
-
-    # Calculate grid size in a more efficient way taking into account orientation:
-    # Vertical screens take about 1/3 of the horizontal size so we can fit more frames in a row.
-    # BUT the exact proportions (w / (h / (w / h))) can't be used because with any gap between frames 
-    # we can't really fit any more than two vertical frames, hence tmp += 1/2
-    tmp = 0
-    for num in global_knowledge["wss"].keys():
-        w = global_knowledge["wss"][num]['size'][0]
-        h = global_knowledge["wss"][num]['size'][1]
-        a = 0
-        if h > w:
-            # tmp += (w / (h / (w / h) ))  # exact
-            tmp += 1 / 2  # any gap approximation
-        else:
-            tmp += 1
-    for o in outputs:
-        w = o.rect.width
-        h = o.rect.height
-        if h > w:
-            # tmp += (w / (h / (w / h) ))
-            tmp += 1 / 2
-        else:
-            tmp += 1
 
-    grid_x = grid_y = math.ceil(math.sqrt(tmp))
-    grid_size = math.ceil(math.sqrt(len(workspaces) + len(outputs)))
-    # print("GRID SIZE: {} x {} ".format(grid_size, grid_size), "EFFICIENT SIZE: {} x {}".format(grid_x, grid_y))
+# Bumped for every new (or patched) screenshot, so a thumbnail never outlives the image it was scaled from
+screenshot_generation = itertools.count(1)
 
-    frame_thickness = get_config('UI', 'frame_width_px')
 
-    frame_active_color = get_config('UI', 'frame_active_color')
-    frame_inactive_color = get_config('UI', 'frame_inactive_color')
-    frame_unknown_color = get_config('UI', 'frame_unknown_color')
-    frame_nonexistant_color = get_config('UI', 'frame_nonexistant_color')
+class ThumbnailCache:
+    """Scaled screenshots, kept across overview sessions.
 
-    tile_active_color = get_config('UI', 'bgcolor')
-    tile_inactive_color = get_config('UI', 'bgcolor')
-    tile_unknown_color = get_config('UI', 'tile_unknown_color')
-    tile_nonexistant_color = get_config('UI', 'tile_nonexistant_color')
+    Keyed by (workspace, screenshot generation, size): a thumbnail is only scaled again when the screenshot
+    or the tile size changed. The least recently used ones are dropped past thumbnail_cache_mb.
+    """
 
-    names_font = get_config('UI', 'names_font')
-    names_fontsize = get_config('UI', 'names_fontsize')
-    names_color = get_config('UI', 'names_color')
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.size = 0
 
-    highlight_percentage = get_config('UI', 'highlight_percentage')
+    def get(self, key, load):
+        # The thumbnail for key = (workspace, generation, (w, h)), scaled from load() if it's not cached yet
+        thumb = self.entries.get(key)
+        if thumb is not None:
+            self.entries.move_to_end(key)
+            stats.count('thumbnail_cache_hits')
+            return thumb
+
+        stats.count('thumbnail_cache_misses')
+        with stats.timer('scale'):
+            thumb = pygame.transform.smoothscale(load(), key[2])
+        self.entries[key] = thumb
+        self.size += self.bytes(thumb)
+
+        limit = get_config('UI', 'thumbnail_cache_mb') * 1024 * 1024
+        while self.size > limit and len(self.entries) > 1:
+            _, old = self.entries.popitem(last=False)
+            self.size -= self.bytes(old)
+        return thumb
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    @staticmethod
+    def bytes(surface):
+        return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+
+thumbnail_cache = ThumbnailCache()
+
+
+class ExpoFrame:
+    """The overview, composed on an off-screen surface.
+
+    It's kept warm in the background: when a screenshot changes only the tile of that workspace is drawn
+    again, so that opening the overview just has to present it. Everything is laid out and drawn again
+    when the workspaces, the outputs or the size of the overview window change.
+    """
+
+    def __init__(self):
+        self.surface = None
+        self.layout = None
+        self.screen_size = None  # Size of the overview window, the monitor size until it's known
+        self.dirty = set()
+        self.active = None
+        self.config_version = None
+
+    def invalidate(self, index=None):
+        # Draw the tile of a workspace again at the next refresh (or all of them, without index)
+        if index is None:
+            self.layout = None
+        else:
+            self.dirty.add(index)
+
+    def refresh(self, screen_size=None):
+        # Bring the surface up to date for the given window size (the last known one by default)
+        if screen_size is not None:
+            self.screen_size = screen_size
+        elif self.screen_size is None:
+            self.screen_size = global_knowledge['monitor_size']
+
+        outputs = workspace_model.get_outputs()
+        with stats.timer('layout'):
+            layout = get_layout(self.screen_size, outputs)
+        if layout != self.layout or self.config_version != settings.version:
+            self.build(layout, outputs)
+            self.dirty = set(layout.wss_idx)
+        elif self.active != global_knowledge['active']:
+            self.dirty.update((self.active, global_knowledge['active']))
+        self.active = global_knowledge['active']
+
+        if self.dirty:
+            with stats.timer('draw'):
+                for index in self.dirty:
+                    if index in layout.tiles.keys():
+                        self.draw_tile(index)
+        self.dirty = set()
+        return self.surface
+
+    def build(self, layout, outputs):
+        # Start over with a new layout: placeholders, frames and an empty surface
+        self.layout = layout
+        self.config_version = settings.version
+        monitor_size = global_knowledge['monitor_size']
+
+        # Thumbnails for ? and +
+        self.thumb_missing, self.thumb_new, self.placeholders_generation = get_placeholders(monitor_size)
+
+        # Outputs the new workspaces would be created on
+        self.new_wss_output = {idx: next(o for o in outputs if o.name == name)
+                               for idx, name in layout.new_wss_output.items()}
+
+        # Frames (and their overlays cache)
+        frame_template = {'active': False,
+                          'mouseoff': None,
+                          'mouseon': None,
+                          'mouseondrag': None,
+                          'ul': (0, 0),
+                          'br': (0, 0)}
+        self.frames = {i: frame_template.copy() for i in layout.wss_idx}
+        for index, tile in layout.tiles.items():
+            self.frames[index]['ul'] = (tile.x, tile.y)
+            self.frames[index]['br'] = (tile.x + tile.outer_w, tile.y + layout.tiles_outer_h)
+
+        self.surface = pygame.Surface(self.screen_size)
+        self.surface.fill(get_config('UI', 'bgcolor'))
+
+    def draw_tile(self, index):
+        screen = self.surface
+        layout = self.layout
+        frame_thickness = get_config('UI', 'frame_width_px')
+        tiles_outer_h = layout.tiles_outer_h
+        tiles_inner_w = layout.tiles_inner_w
+        tiles_inner_h = layout.tiles_inner_h
+        tile_origin_x, tile_origin_y, tiles_outer_w_dyn, tiles_inner_w_dyn = layout.tiles[index]
+
+        # Different properties for different kinds of thumbnails. image is None for the screenshot of the
+        # workspace, which is only loaded from the preview store if its thumbnail isn't cached
+        image = None
+        if global_knowledge['active'] == index:
+            tile_color = get_config('UI', 'bgcolor')
+            frame_color = get_config('UI', 'frame_active_color')
+            if not previews.has(index):
+                image = self.thumb_missing
+        elif index in global_knowledge["wss"].keys() and previews.has(index):
+            tile_color = get_config('UI', 'bgcolor')
+            frame_color = get_config('UI', 'frame_inactive_color')
+        elif index in global_knowledge["wss"].keys():
+            tile_color = get_config('UI', 'tile_unknown_color')
+            frame_color = get_config('UI', 'frame_unknown_color')
+            image = self.thumb_missing
+        else:
+            tile_color = get_config('UI', 'tile_nonexistant_color')
+            frame_color = get_config('UI', 'frame_nonexistant_color')
+            image = self.thumb_new
+
+        # Thumbnail cache key of the image: placeholders have their own generation
+        if image is self.thumb_missing:
+            thumb_key = ('?', self.placeholders_generation)
+        elif image is self.thumb_new:
+            thumb_key = ('+', self.placeholders_generation)
+        else:
+            thumb_key = (index, global_knowledge["wss"][index]['generation'])
+
+        # Clear the label area under the tile, the label could have been wider
+        screen.fill(get_config('UI', 'bgcolor'), (tile_origin_x - layout.tiles_gap_w // 2, tile_origin_y + tiles_outer_h,
+                                                  tiles_outer_w_dyn + layout.tiles_gap_w, layout.tiles_gap_h))
+        # Draw frame
+        screen.fill(frame_color, (tile_origin_x, tile_origin_y, tiles_outer_w_dyn, tiles_outer_h,))
+        # Draw tile
+        screen.fill(tile_color, (tile_origin_x + frame_thickness, tile_origin_y + frame_thickness,
+                                 tiles_inner_w_dyn, tiles_inner_h,))
+
+        # Calculate thumbnail placement and size
+        image_w, image_h = image.get_size() if image is not None else previews.get_size(index)
+        crop = None
+
+        # Resize / crop the image to fit the tile
+        if image_w > image_h and tiles_inner_w_dyn < tiles_inner_h:
+            result_x = tiles_inner_w
+            result_y = tiles_inner_h
+            offset_x = round((tiles_inner_w - result_x) / 2)
+            offset_y = 0
+            crop = (tiles_inner_w / 2 - tiles_inner_w_dyn / 2, 0, tiles_inner_w_dyn, tiles_inner_h)
+        else:
+            result_x = tiles_inner_w_dyn
+            result_y = tiles_inner_h
+            offset_x = 0
+            offset_y = round((tiles_inner_h - result_y) / 2)
+
+        # Rescale the screenshot as a thumbnail (unless it already was, for this size)
+        if image is None:
+            load = lambda: previews.get(index)
+        else:
+            load = lambda placeholder=image: placeholder
+        image = thumbnail_cache.get(thumb_key + ((result_x, result_y),), load)
+
+        # Put the right label (workspace name or output name for the ws to be created on)
+        if index in global_knowledge["wss"].keys():
+            name = global_knowledge["wss"][index]['name']
+            out_name = global_knowledge["wss"][index]['output']
+            if out_name.lower() in global_knowledge['out_aliases'].keys():
+                out_name = global_knowledge['out_aliases'][out_name.lower()]
+            name += " (" + out_name + ")"
+        else:
+            name = self.new_wss_output[index].name
+            if name.lower() in global_knowledge['out_aliases'].keys():
+                name = global_knowledge['out_aliases'][name.lower()]
+
+        # Calculate label / caption
+        name = render_caption(name)
+        name_width = name.get_rect().size[0]
+        name_x = tile_origin_x + round((tiles_outer_w_dyn - name_width) / 2)
+        name_y = tile_origin_y + tiles_outer_h + round(tiles_outer_h * 0.02)
+
+        if get_config('UI', 'names_position') == NamesPosition.INSIDE:
+            name_y = tile_origin_y + tiles_inner_h - name.get_rect().size[1]
+
+        # DRAW the screenshot as a thumbnail
+        screen.blit(image, (tile_origin_x + frame_thickness + offset_x,
+                            tile_origin_y + frame_thickness + offset_y), crop)
+
+        # Draw the label / caption
+        screen.blit(name, (name_x, name_y))
+
+        # Calculate mouseon, mouseoff, mousedrag overlays and cache them
+        highlight_percentage = get_config('UI', 'highlight_percentage')
+        mouseoff = screen.subsurface(
+            (tile_origin_x, tile_origin_y, tiles_outer_w_dyn, tiles_outer_h)).copy()
+        lightmask = pygame.Surface((tiles_outer_w_dyn, tiles_outer_h), pygame.SRCALPHA, 32)
+        lightmask_drag = lightmask.copy()
+        lightmask.fill((255, 255, 255, 255 * highlight_percentage / 100))
+        lightmask_drag.fill((128, 128, 255, 255 * highlight_percentage / 100))
+        mouseon = mouseoff.copy()
+        mouseondrag = mouseoff.copy()
+        mouseon.blit(lightmask, (0, 0))
+        mouseondrag.blit(lightmask_drag, (0, 0))
+        self.frames[index]['mouseon'] = mouseon
+        self.frames[index]['mouseondrag'] = mouseondrag
+        self.frames[index]['mouseoff'] = mouseoff
+
+
+expo_frame = ExpoFrame()
+
+
+def get_layout(screen_size, outputs):
+    return expolayout.compute_layout(
+        tuple(sorted((num, ws['size']) for num, ws in global_knowledge["wss"].items())),
+        tuple((o.name, (o.rect.width, o.rect.height)) for o in outputs),
+        tuple(screen_size),
+        (get_config('UI', 'padding_percent_x'), get_config('UI', 'padding_percent_y')),
+        (get_config('UI', 'spacing_percent_x'), get_config('UI', 'spacing_percent_y')),
+        get_config('UI', 'frame_width_px'),
+        args.mode)
+
+
+def open_overview_window(size):
+    # Create the overview window, or just show it again if it's kept between sessions
+    screen = pygame.display.get_surface()
+    window = global_knowledge['ui_cache'].get('window')
+    if screen is not None and window is not None:
+        window.show()
+        window.focus()
+        return screen
 
-    # Create screen surface and set display options
     screen_mode = pygame.FULLSCREEN if args.fullscreen else pygame.RESIZABLE
-    screen = pygame.display.set_mode(size=(monitor_size[0], monitor_size[1]), flags=screen_mode, depth=0, display=0)
+    screen = pygame.display.set_mode(size=size, flags=screen_mode, depth=0, display=0)
     screen.set_alpha(None)
     pygame.display.set_caption('i3expo-ng')
 
-    # Usable screen space (if windowed it won't match monitor_size)
-    screen_w = screen.get_width()
-    screen_h = screen.get_height()
-
-    # Padding/margin for tiles
-    pad_w = round(screen_w * get_config('UI', 'padding_percent_x') / 100)
-    pad_h = round(screen_h * get_config('UI', 'padding_percent_y') / 100)
-
-    # Gap between tiles (do not confuse with frames)
-    tiles_gap_w = round(screen_w * get_config('UI', 'spacing_percent_x') / 100)
-    tiles_gap_h = round(screen_h * get_config('UI', 'spacing_percent_y') / 100)
-
-    # Outer and inner tiles size (draw outer then inner to get the frame)
-    tiles_outer_w = round((screen_w - 2 * pad_w - tiles_gap_w * (grid_x - 1)) / grid_x)
-    tiles_outer_h = round((screen_h - 2 * pad_h - tiles_gap_h * (grid_y - 1)) / grid_y)
-    tiles_inner_w = tiles_outer_w - 2 * frame_thickness
-    tiles_inner_h = tiles_outer_h - 2 * frame_thickness
-
-    # Gap between frames
-    frames_gap_w = tiles_outer_w + tiles_gap_w
-    frames_gap_h = tiles_outer_h + tiles_gap_h
-
-    # Thumbnails for ? and +
-    thumb_missing = pygame.Surface((monitor_size[0], monitor_size[1]), pygame.SRCALPHA, 32)
-    thumb_missing = thumb_missing.convert_alpha()
-    thumb_new = thumb_missing.copy()
-    qm = pygame.font.SysFont('sans-serif', 550).render('?', True, (150, 150, 150))
-    plss = pygame.font.SysFont('sans-serif', 550).render('+', True, (200, 200, 200))
-    qm_size = qm.get_rect().size
-    origin_x = round((monitor_size[0] - qm_size[0]) / 2)
-    origin_y = round((monitor_size[1] - qm_size[1]) / 2)
-    thumb_missing.blit(qm, (origin_x, origin_y))
-
-    # if a wallpaper was specified, use that as a background for thumb_new
-    if args.wp is not None:
-        if 'wp_img' not in global_knowledge['ui_cache'].keys():
-            im = Image.open(args.wp)
-            en = ImageEnhance.Brightness(im)
-            wp_img = en.enhance(0.4)
-            wp_img = wp_img \
-                .resize((monitor_size[0], monitor_size[1]), Image.NEAREST) \
-                .filter(ImageFilter.GaussianBlur(radius=20))
-            wp_img = pygame.image.fromstring(wp_img.tobytes(), wp_img.size, wp_img.mode)
-            global_knowledge['ui_cache']['wp_img'] = wp_img
-        wp_img = global_knowledge['ui_cache']['wp_img']
-        thumb_new.blit(wp_img, (0, 0))
-
-    thumb_new.blit(plss, (origin_x, origin_y))  # Then draw the + sign
-
-    font = pygame.font.SysFont(names_font, names_fontsize)
-
-    # Get existing workspaces indexes
-    wss_idx = [int(k) for k in global_knowledge["wss"].keys()]
-    # Sort workspace indexes by aspect ratio (landscape then portrait)
-    wss_idx.sort(key=lambda x: global_knowledge['wss'][x]['size'][1])
-
-    # Generate one new/empty ws for each display output available:
-    new_wss_output = {}
-    tmp = []
-    if args.mode == "sequential":
-        r = max(1000, wss_idx[-1])  # or r = 1000
-    elif args.mode == "filler":
-        r = 1
-    for out in outputs:
-        while r in wss_idx + tmp:
-            r += 1
-        new_wss_output[r] = out
-        tmp.append(r)
-
-    # Sort NEW workspace indexes by aspect ratio (portrait then landscape) and append them to the list of workspaces
-    tmp.sort(key=lambda x: new_wss_output[x].rect.width)
-    wss_idx.extend(tmp)
-    del tmp
-
-    # Desktop index matrix for keyboard navigation
-    kbd_grid = [-1 for _ in range(grid_y)]
-    for i in range(len(kbd_grid)):
-        kbd_grid[i] = [-1 for _ in range(grid_size * grid_size)]
-
-    # Thumbnails and frames cache
-    thumb_cache = {i: None for i in wss_idx}
-    frame_template = {'active': False,
-                      'mouseoff': None,
-                      'mouseon': None,
-                      'mouseondrag': None,
-                      'ul': (0, 0),
-                      'br': (0, 0)}
-    frames = {i: frame_template.copy() for i in wss_idx}
-
-    def draw_grid():
-        screen.fill(get_config('UI', 'bgcolor'))
-        wss_idx_todo = wss_idx.copy()
-
-        for y in range(grid_y):
-            tile_last_x = 0
-            for x in range(grid_x * grid_x):
-                # Origin point for next tile will be after the last one on this row
-                tile_origin_x = tile_last_x + tiles_gap_w if tile_last_x != 0 else pad_w
-                tile_origin_y = pad_h + frames_gap_h * y
-
-                # Extract the next workspace index and place it on the matrix
-                index = None
-                for i, idx in enumerate(wss_idx_todo):
-                    tiles_outer_w_dyn = tiles_outer_w
-                    tiles_inner_w_dyn = tiles_inner_w
-
-                    # Is it an existing ws or a new one to be created?
-                    ws_width = global_knowledge["wss"][idx]['size'][0] if idx in global_knowledge["wss"].keys() \
-                        else new_wss_output[idx].rect.width
-                    ws_height = global_knowledge["wss"][idx]['size'][1] if idx in global_knowledge["wss"].keys() \
-                        else new_wss_output[idx].rect.height
-
-                    # Resize frame width for vertical workspaces
-                    if ws_height > ws_width:
-                        factor = (ws_height / (ws_width / (ws_height / ws_width)))
-                        tiles_outer_w_dyn = round(tiles_outer_w_dyn / factor)
-                        tiles_inner_w_dyn = tiles_outer_w_dyn - 2 * frame_thickness
-
-                    # If it fits on the row, place it and remove its index from the todo list
-                    if tile_origin_x + tiles_outer_w_dyn <= screen_w - pad_w:
-                        index = idx
-                        del wss_idx_todo[i]
-                        break
-
-                if index is None:
-                    break
-
-                tile_last_x = tile_origin_x + tiles_outer_w_dyn
-                kbd_grid[y][x] = index
-                frames[index]['ul'] = (tile_origin_x, tile_origin_y)
-                frames[index]['br'] = (tile_origin_x + tiles_outer_w_dyn, tile_origin_y + tiles_outer_h)
-
-                # Different properties for different kinds of thumbnails
-                if global_knowledge['active'] == index:
-                    tile_color = tile_active_color
-                    frame_color = frame_active_color
-                    image = global_knowledge["wss"][index]['screenshot']
-                elif index in global_knowledge["wss"].keys() and \
-                        global_knowledge["wss"][index]['screenshot']:
-                    tile_color = tile_inactive_color
-                    frame_color = frame_inactive_color
-                    image = global_knowledge["wss"][index]['screenshot']
-                elif index in global_knowledge["wss"].keys():
-                    tile_color = tile_unknown_color
-                    frame_color = frame_unknown_color
-                    image = thumb_missing
-                else:
-                    tile_color = tile_nonexistant_color
-                    frame_color = frame_nonexistant_color
-                    image = thumb_new
-
-                # Draw frame
-                screen.fill(frame_color, (tile_origin_x, tile_origin_y, tiles_outer_w_dyn, tiles_outer_h,))
-                # Draw tile
-                screen.fill(tile_color, (tile_origin_x + frame_thickness, tile_origin_y + frame_thickness,
-                                         tiles_inner_w_dyn, tiles_inner_h,))
-
-                # Calculate thumbnail placement and size
-                image_w = image.get_rect().size[0]
-                image_h = image.get_rect().size[1]
-                crop = None
-
-                # Resize / crop the image to fit the tile
-                if image_w > image_h and tiles_inner_w_dyn < tiles_inner_h:
-                    result_x = tiles_inner_w
-                    result_y = tiles_inner_h
-                    offset_x = round((tiles_inner_w - result_x) / 2)
-                    offset_y = 0
-                    crop = (tiles_inner_w / 2 - tiles_inner_w_dyn / 2, 0, tiles_inner_w_dyn, tiles_inner_h)
-                else:
-                    result_x = tiles_inner_w_dyn
-                    result_y = tiles_inner_h
-                    offset_x = 0
-                    offset_y = round((tiles_inner_h - result_y) / 2)
-
-                # Rescale the screenshot as a thumbnail and cache it, or use the cached result if present
-                if thumb_cache[index] is not None:
-                    image = thumb_cache[index]
-                else:
-                    image = pygame.transform.smoothscale(image, (result_x, result_y))
-                    thumb_cache[index] = image
-
-                # Put the right label (workspace name or output name for the ws to be created on)
-                if index in global_knowledge["wss"].keys():
-                    name = global_knowledge["wss"][index]['name']
-                    out_name = global_knowledge["wss"][index]['output']
-                    if out_name.lower() in global_knowledge['out_aliases'].keys():
-                        out_name = global_knowledge['out_aliases'][out_name.lower()]
-                    name += " (" + out_name + ")"
-                else:
-                    name = new_wss_output[index].name
-                    if name.lower() in global_knowledge['out_aliases'].keys():
-                        name = global_knowledge['out_aliases'][name.lower()]
-
-                # Calculate label / caption
-                name = font.render(name, True, names_color)
-                name_width = name.get_rect().size[0]
-                name_x = tile_origin_x + round((tiles_outer_w_dyn - name_width) / 2)
-                name_y = tile_origin_y + tiles_outer_h + round(tiles_outer_h * 0.02)
-
-                if get_config('UI', 'names_position') == "inside":
-                    name_size = name.get_size()
-                    name_bg_margin_x = 8
-                    name_bg_margin_y = 8
-                    name_size = (name_size[0] + name_bg_margin_x, name_size[1] + name_bg_margin_y)
-                    name_bg = pygame.Surface(name_size)
-                    name_bg.fill((0, 0, 0))
-                    name_bg.blit(name, (name_bg_margin_x / 2, name_bg_margin_x / 2))
-                    name = name_bg
-                    name_y = tile_origin_y + tiles_inner_h - name.get_rect().size[1]
-
-                # DRAW the screenshot as a thumbnail
-                screen.blit(image, (tile_origin_x + frame_thickness + offset_x,
-                                    tile_origin_y + frame_thickness + offset_y), crop)
-
-                # Draw the label / caption
-                screen.blit(name, (name_x, name_y))
-
-                # Calculate mouseon, mouseoff, mousedrag overlays and cache them
-                if frames[index]['mouseon'] is None:
-                    mouseoff = screen.subsurface(
-                        (tile_origin_x, tile_origin_y, tiles_outer_w_dyn, tiles_outer_h)).copy()
-                    lightmask = pygame.Surface((tiles_outer_w_dyn, tiles_outer_h), pygame.SRCALPHA, 32)
-                    lightmask.convert_alpha()
-                    lightmask_drag = lightmask.copy()
-                    lightmask.fill((255, 255, 255, 255 * highlight_percentage / 100))
-                    lightmask_drag.fill((128, 128, 255, 255 * highlight_percentage / 100))
-                    mouseon = mouseoff.copy()
-                    mouseondrag = mouseoff.copy()
-                    mouseon.blit(lightmask, (0, 0))
-                    mouseondrag.blit(lightmask_drag, (0, 0))
-                    frames[index]['mouseon'] = mouseon.copy()
-                    frames[index]['mouseondrag'] = mouseondrag.copy()
-                    frames[index]['mouseoff'] = mouseoff.copy()
+    if get_config('UI', 'keep_window'):
+        try:
+            from pygame._sdl2.video import Window
+            global_knowledge['ui_cache']['window'] = Window.from_display_module()
+        except (ImportError, AttributeError, pygame.error):
+            pass  # Not available on this pygame/SDL, the window will be destroyed after use
+    return screen
+
+
+def close_overview_window():
+    window = global_knowledge['ui_cache'].get('window')
+    if window is not None and get_config('UI', 'keep_window'):
+        # Unmap the window, keeping it (and its surface) around for the next time
+        window.hide()
+        pygame.event.clear()
+    else:
+        global_knowledge['ui_cache'].pop('window', None)
+        pygame.display.quit()
+        pygame.display.init()
+
+
+def zoom_in(screen, background, image, tile_rect, size, animator):
+    # The screenshot grows from its tile to the size its workspace would have in the window. Nothing but
+    # the union of two successive rects is pushed to the display; any key or click skips the rest of it
+    screen_w, screen_h = screen.get_size()
+    factor = min(screen_w / size[0], screen_h / size[1])
+    w, h = round(size[0] * factor), round(size[1] * factor)
+    target = ((screen_w - w) // 2, (screen_h - h) // 2, w, h)
+
+    zoom = animator.start(expoanim.Animation(get_config('UI', 'zoom_ms') / 1000, expoanim.ease_in_out_quad))
+    previous = pygame.Rect(tile_rect)
+    while animator.running():
+        timeout = animator.timeout(IDLE_TIMEOUT_MS)
+        events = ([pygame.event.wait(timeout)] if timeout > 0 else []) + pygame.event.get()
+        if any(event.type in (pygame.QUIT, pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN, CLOSE_EVENT) for event in events):
+            animator.stop(zoom)
+            break
+        if not animator.due():
+            continue
+        rect = pygame.Rect(expoanim.lerp_rect(tile_rect, target, zoom.progress(animator.now)))
+        screen.blit(background, previous, previous)
+        screen.blit(pygame.transform.scale(image, rect.size), rect)
+        pygame.display.update(previous.union(rect))
+        previous = rect
+        animator.presented()
 
-    pygame.display.flip()
+
+def show_ui():
+    global global_updates_running
+    cmd = None
+    try:
+        cmd = _show_ui()
+    finally:
+        # However the overview ended, i3 leaves the temporary workspace and the captures resume
+        try:
+            close_overview_window()
+        finally:
+            # If quitting without jump, jump back to the active workspace on the primary output
+            if not cmd:
+                cmd = 'workspace ' + global_knowledge['visible_ws_primary_name'] + ';'
+            try:
+                with stats.timer('command'):
+                    i3.command(cmd)
+            finally:
+                # Unlock the global updates
+                global_updates_running = True
+                workspace_model.overview_closed()
+
+
+def _show_ui():
+    # Runs the overview until it's closed, returns the i3 command of the user's choice (None to go back)
+    FPS = 60
+
+    clock = pygame.time.Clock()
+
+    # Get monitor size
+    monitor_size = global_knowledge['monitor_size']
+
+    # Create screen surface and set display options
+    screen = open_overview_window((monitor_size[0], monitor_size[1]))
+
+    # Usable screen space (if windowed it won't match monitor_size): only present the background frame,
+    # unless something changed since it was last composed
+    with state_lock:
+        background = expo_frame.refresh(screen.get_size())
+        layout = expo_frame.layout
+        frames = expo_frame.frames
+        for frame in frames.values():
+            frame['active'] = False
+        new_wss_output = expo_frame.new_wss_output
+    kbd_grid = layout.kbd_grid
+    wss_idx = layout.wss_idx
+    tiles_inner_w = layout.tiles_inner_w
+    tiles_inner_h = layout.tiles_inner_h
+    pad_w = layout.pad_w
+    pad_h = layout.pad_h
 
     # set initial status
     active_frame = None
@@ -610,15 +1949,19 @@ def show_ui():
     rectangle_dragging = False
     running = True
     use_mouse = True
-    grid_dirty_flag = False
 
     # For keyboard navigation
     col_idx = 0
     row_idx = 0
 
     # Focused window thumb overlay to be dragged over to workspaces
-    focused_win_screenshot = global_knowledge['wss'][global_knowledge['active']]['focused_win_screenshot']
-    focused_win_size = global_knowledge['wss'][global_knowledge['active']]['focused_win_size']
+    with state_lock:
+        active_info = global_knowledge['wss'].get(global_knowledge['active'], {})
+        focused_win_screenshot = active_info.get('focused_win_screenshot')
+        # Only needed for the thumbnail below: don't keep it with the workspace until the next time
+        active_info['focused_win_screenshot'] = None
+        focused_win_size = active_info.get('focused_win_size')
+        focused_win_id = active_info.get('focused_win_id')
 
     # Get screenshot aspect ratio and scale it to be a bit smaller than the workspaces thumb
     focused_win_thumb = None
@@ -641,41 +1984,42 @@ def show_ui():
 
         focused_win_thumb = pygame.transform.smoothscale(focused_win_screenshot, (rectangle.width, rectangle.height))
 
-        with suppress(KeyError):
-            focused_win_id = global_knowledge['wss'][global_knowledge['active']]['focused_win_id']
-
     # Draw grid
-    draw_grid()
-
-    # Draw focused window thumbnail overlay border
-    if focused_win_thumb is not None:
-        lightmask, lightmask_position = gen_active_win_overlay(rectangle, alpha=0)
-        screen.blit(lightmask, lightmask_position)
-        speed = int(300 / FPS)
-        for i in range(0, 100, speed):
-            alpha = int(255 * i / 100)
-            f = focused_win_thumb.convert_alpha()
-            f.fill((255, 255, 255, alpha), None, pygame.BLEND_RGBA_MULT)
-            lightmask.fill(YELLOW + (int(alpha / 8),))
-            screen.blit(lightmask, lightmask_position)
-            screen.blit(f, rectangle)
-            pygame.display.flip()
-            clock.tick(FPS)
-
-    # Main loop: redraw screen and check status
+    screen.blit(background, (0, 0))
+    pygame.display.flip()
+    if stats.enabled and 'show_requested' in global_knowledge.keys():
+        stats.record('first_frame', (time.perf_counter() - global_knowledge['show_requested']) * 1000)
+
+    # The focused window thumbnail and its border, in one opaque surface faded in with its surface alpha
+    animator = expoanim.Animator(FPS)
+    thumb_bounds = None
+    thumb_fade = None
+    if rectangle is not None:
+        lightmask, lightmask_position = gen_active_win_overlay(rectangle)
+        thumb_bounds = pygame.Rect(lightmask_position, lightmask.get_size())
+        thumb_overlay = pygame.Surface(thumb_bounds.size).convert()
+        thumb_overlay.blit(lightmask, (0, 0))
+        thumb_overlay.blit(focused_win_thumb, (rectangle.x - thumb_bounds.x, rectangle.y - thumb_bounds.y))
+        thumb_fade = animator.start(expoanim.Animation(get_config('UI', 'fade_ms') / 1000))
+
+    # Main loop: wait for user interaction (or the next frame of an animation) and only redraw (and push
+    # to the display) what changed
+    redraw_active = True
+    redraw_thumb = rectangle is not None
+    jump = False  # If toggled off before the first iteration, go back where we were
     while running and not global_updates_running and pygame.display.get_init():
-
-        # Avoid trailing effect when dragging the focused window preview over a workspace
-        if rectangle_dragging:
-            draw_grid()
-
         jump = False
         move_win = False
         kbdmove = (0, 0)
         cmd = ""
-
-        # Check for user interaction (via keyboard or mouse)
-        for event in pygame.event.get():
+        dirty_rects = []
+        was_dragging = rectangle_dragging
+
+        # Check for user interaction (via keyboard or mouse), sleeping until there is some. hide_overview
+        # posts CLOSE_EVENT to wake the loop up when the overview is toggled off
+        timeout = animator.timeout(IDLE_TIMEOUT_MS)
+        events = ([pygame.event.wait(timeout)] if timeout > 0 else []) + pygame.event.get()
+        for event in events:
             if event.type == pygame.QUIT:
                 running = False
             elif event.type == pygame.MOUSEMOTION:
@@ -722,7 +2066,7 @@ def show_ui():
         # Determine which frame is being hovered either with the mouse or keyboard selection
         if use_mouse:
             mpos = pygame.mouse.get_pos()
-            af = get_hovered_frame(mpos, frames)
+            af = expolayout.hit_test(layout, mpos)
             active_frame = af if af is not None else last_active_frame
             last_active_frame = active_frame
         elif kbdmove != (0, 0):
@@ -763,7 +2107,7 @@ def show_ui():
                 cmd += 'move workspace to output ' + new_wss_output[active_frame].name + ';'
 
             # Jump back to the visible ws on primary output to preserve back_and_forth behaviour
-            cmd += 'workspace ' + global_knowledge["wss"][global_knowledge['visible_ws_primary']]['name'] + ';'
+            cmd += 'workspace ' + global_knowledge['visible_ws_primary_name'] + ';'
 
             # Jump to the requested workspace (by its name if already exists, by its number if it's created anew)
             if active_frame in global_knowledge["wss"].keys():
@@ -772,59 +2116,122 @@ def show_ui():
                 cmd += 'workspace ' + str(active_frame)
             break
 
-        # DRAW mouseoff, mouseon, mouseondrag overlays
+        # The dragged window thumbnail moved: put the background back where it was
+        if rectangle is not None:
+            lightmask, lightmask_position = gen_active_win_overlay(rectangle)
+            new_thumb_bounds = pygame.Rect(lightmask_position, lightmask.get_size())
+            if new_thumb_bounds != thumb_bounds:
+                screen.blit(background, thumb_bounds, thumb_bounds)
+                dirty_rects.append(thumb_bounds)
+                if active_frame in frames.keys() and thumb_bounds.colliderect(frame_rect(frames[active_frame])):
+                    redraw_active = True
+                thumb_bounds = new_thumb_bounds
+                redraw_thumb = True
+
+        # Next frame of the fade in, drawn again over the background below
+        animation_frame = animator.due()
+        if animation_frame and thumb_fade is not None:
+            if thumb_fade.done(animator.now):
+                thumb_overlay.set_alpha(None)
+                thumb_fade = None
+            else:
+                thumb_overlay.set_alpha(round(255 * thumb_fade.progress(animator.now)))
+            screen.blit(background, thumb_bounds, thumb_bounds)
+            dirty_rects.append(thumb_bounds)
+            if active_frame in frames.keys() and thumb_bounds.colliderect(frame_rect(frames[active_frame])):
+                redraw_active = True
+            redraw_thumb = True
+
+        # DRAW mouseoff, mouseon, mouseondrag overlays of the frames whose state changed
         for frame in frames.keys():
             if frames[frame]['active'] and not frame == active_frame:
                 screen.blit(frames[frame]['mouseoff'], frames[frame]['ul'])
                 frames[frame]['active'] = False
-                grid_dirty_flag = True
-        if active_frame:  # and not frames[active_frame]['active']:
-            screen.blit(frames[active_frame]['mouseon'], frames[active_frame]['ul'])
-            grid_dirty_flag = True
-            if rectangle_dragging:
-                screen.blit(frames[active_frame]['mouseondrag'], frames[active_frame]['ul'])
+                dirty_rects.append(frame_rect(frames[frame]))
+        if active_frame:
+            if not frames[active_frame]['active'] or redraw_active or was_dragging != rectangle_dragging:
+                overlay = frames[active_frame]['mouseondrag' if rectangle_dragging else 'mouseon']
+                screen.blit(overlay, frames[active_frame]['ul'])
+                dirty_rects.append(frame_rect(frames[active_frame]))
             frames[active_frame]['active'] = True
-
-        if (rectangle_dragging or grid_dirty_flag) and rectangle is not None:
-            grid_dirty_flag = False
-            lightmask, lightmask_position = gen_active_win_overlay(rectangle)
-            # DRAW active window border overlay
-            screen.blit(lightmask, lightmask_position)
-            # DRAW active window thumbnail
-            screen.blit(focused_win_thumb, rectangle) if focused_win_thumb is not None else None
-
-        pygame.display.update()
-        clock.tick(FPS)
-
-    pygame.display.quit()
-    pygame.display.init()
-
-    # If quitting without jump, jump back to the active workspace on the primary output
-    if not jump:
-        cmd = 'workspace ' + global_knowledge["wss"][global_knowledge['visible_ws_primary']]['name'] + ';'
-
-    i3.command(cmd)
-
-    # Unlock the global updates
-    global_updates_running = True
+        redraw_active = False
+
+        # The frames drawn above may have covered the window thumbnail
+        if rectangle is not None and (redraw_thumb or thumb_bounds.collidelist(dirty_rects) >= 0):
+            redraw_thumb = False
+            # DRAW active window thumbnail and its border
+            screen.blit(thumb_overlay, thumb_bounds)
+            dirty_rects.append(thumb_bounds)
+
+        if dirty_rects:
+            pygame.display.update(dirty_rects)
+            if animation_frame:
+                animator.presented()
+            elif not animator.running():
+                clock.tick(FPS)
+
+    # Zoom into the workspace we jump to
+    if jump and not move_win and get_config('UI', 'zoom_ms') > 0 and previews.has(active_frame) and \
+            pygame.display.get_init():
+        with state_lock:
+            image = previews.get(active_frame)
+            size = global_knowledge['wss'][active_frame]['size'] if image is not None else None
+        if image is not None:
+            if thumb_fade is not None:
+                animator.stop(thumb_fade)
+            zoom_in(screen, background, image, frame_rect(frames[active_frame]), size, animator)
+
+    stats.count('frames_skipped', animator.skipped)
+    return cmd if jump else None
 
 
 def reset_update_timer(i3, e):
-    global last_update
-    last_update = time.time()
+    # Don't take a screenshot while the compositor is still fading from one workspace to the other,
+    # then take one of the workspace we landed on
+    capture_worker.postpone()
+    capture_worker.request()
+    if window_pixmaps.enabled and getattr(e, 'old', None) is not None and e.old.name != TEMPORARY_WORKSPACE:
+        # The workspace we left, in the state its windows were when they were unmapped
+        capture_worker.request(e.old.num)
 
 
 def main():
     read_config()
     init_knowledge()
-    update_state(i3, None)
-
-    i3.on('window::new', update_state)
-    i3.on('window::close', update_state)
-    i3.on('window::move', update_state)
-    i3.on('window::floating', update_state)
-    i3.on('window::fullscreen_mode', update_state)
-    # i3.on('window::focus', update_state)
+    if get_config('CAPTURE', 'persist_previews'):
+        # Before the first capture, which would replace the restored screenshot of the focused workspace
+        preview_file.load()
+        preview_file.enabled = True
+        preview_file.start()
+    if get_config('EXPORT', 'enabled'):
+        try:
+            preview_export.start()
+        except OSError as e:
+            print("Could not export the screenshots: " + str(e))
+    update_state()
+    if get_config('CAPTURE', 'composite'):
+        if window_pixmaps.start():
+            window_pixmaps.refresh(i3.get_tree())
+        else:
+            print("XComposite is not available, hidden workspaces won't be captured")
+    capture_worker.start()
+    dispatcher.start()
+    try:
+        ControlServer(runtime_path("control.sock")).start()
+    except OSError as e:
+        print("Could not open the control socket, only the signals will work: " + str(e))
+
+    # Keep the workspace model up to date. Registered first, so that the other handlers see the changes
+    i3.on('workspace', workspace_model.on_workspace)
+    i3.on('output', workspace_model.on_output)
+    i3.on('shutdown', workspace_model.on_shutdown)
+
+    i3.on('window::new', schedule_update)
+    i3.on('window::close', schedule_update)
+    i3.on('window::move', schedule_update)
+    i3.on('window::floating', schedule_update)
+    i3.on('window::fullscreen_mode', schedule_update)
+    # i3.on('window::focus', schedule_update)
 
     # Reset time counter so that the update thread does not take a screenshot
     # while transitioning from one workspace to another, resulting in a dirty screenshot
@@ -835,9 +2242,16 @@ def main():
     i3_thread.daemon = True
     i3_thread.start()
 
-    while True:
-        time.sleep(1)
-        update_state(i3, None)
+    if get_config('CAPTURE', 'damage_max_delay_ms') > 0 and prtscn.damageStart():
+        # Everything happens in the i3, damage and capture threads, just wait for signals
+        damage_monitor.start()
+        while True:
+            signal.pause()
+    else:
+        # Without XDamage there's no way to know when the content of a window changes: poll
+        while True:
+            time.sleep(1)
+            capture_worker.request()
 
 
 if __name__ == '__main__':
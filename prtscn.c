@@ -2,56 +2,650 @@
 #include <Python.h>
 #include "prtscn.h"
 #include <stdio.h>
+#include <stdint.h>
+#include <string.h>
+#include <pthread.h>
+#include <sys/ipc.h>
+#include <sys/shm.h>
 #include <X11/X.h>
+#include <X11/Xlib.h>
 #include <X11/Xutil.h>
-//Compile hint: gcc -shared -O3 -lX11 -fPIC -Wl,-soname,prtscn `pkg-config --cflags --libs python3` -o prtscn.so prtscn.c
+#include <X11/extensions/XShm.h>
+#include <X11/extensions/Xdamage.h>
+#include <X11/extensions/Xfixes.h>
+#include <X11/extensions/Xcomposite.h>
+//Compile hint: gcc -shared -O3 -lX11 -lXext -lXdamage -lXfixes -lXcomposite -fPIC -Wl,-soname,prtscn `pkg-config --cflags --libs python3` -o prtscn.so prtscn.c
 
-static void getScreen(const int xx, const int yy, const int W, const int H, /*out*/ unsigned char * data)
+// One connection per process, opened on the first capture and kept for the
+// lifetime of the daemon.
+static Display *display = NULL;
+static Window root;
+
+// Every use of the connection (and of the state below) holds x_lock, taken
+// with the GIL released: the other Python threads keep running during a
+// capture (round trip and conversion), while Xlib is still never entered by
+// two threads at once. Python objects are only touched outside of it.
+static pthread_mutex_t x_lock = PTHREAD_MUTEX_INITIALIZER;
+
+#define X_BEGIN Py_BEGIN_ALLOW_THREADS pthread_mutex_lock(&x_lock);
+#define X_END pthread_mutex_unlock(&x_lock); Py_END_ALLOW_THREADS
+
+// Shared memory segment reused by XShmGetImage as long as it's big enough for
+// the requested size (e.g. one capture per output, of different sizes). use_shm
+// is -1 until the first capture probes the extension.
+static int use_shm = -1;
+static XShmSegmentInfo shminfo;
+static XImage *shm_image = NULL;
+static size_t shm_size = 0;
+
+// Damage tracking of the root window, see damageStart
+static Damage damage = None;
+static XserverRegion damage_region = None;
+static int damage_event_base = 0;
+static int damage_notified = 0;
+
+// Whether the children of the root window are redirected, see compositeStart
+static int composite_started = 0;
+
+// Above this many rectangles getDamage just returns their bounding box
+#define MAX_DAMAGE_RECTS 32
+
+static int x_error_code = 0;
+
+#define PIXEL_LITTLE_ENDIAN (__BYTE_ORDER__ == __ORDER_LITTLE_ENDIAN__)
+
+static int handleXError(Display *d, XErrorEvent *e)
+{
+   // Don't let Xlib's default handler kill the daemon for a failed request,
+   // just remember it and let the caller decide
+   x_error_code = e->error_code;
+   return 0;
+}
+
+static int openDisplay(void)
+{
+   if (display != NULL)
+      return 1;
+
+   display = XOpenDisplay(NULL);
+   if (display == NULL)
+      return 0;
+
+   root = DefaultRootWindow(display);
+   XSetErrorHandler(handleXError);
+   use_shm = XShmQueryExtension(display) ? -1 : 0;
+   return 1;
+}
+
+static void shmRelease(void)
+{
+   if (shm_image == NULL)
+      return;
+
+   XShmDetach(display, &shminfo);
+   XSync(display, False);
+   shm_image->data = NULL;  // owned by the segment, not by Xlib
+   XDestroyImage(shm_image);
+   shmdt(shminfo.shmaddr);
+   shm_image = NULL;
+   shm_size = 0;
+}
+
+static XImage *shmAcquire(const int W, const int H)
+{
+   if (shm_image != NULL && shm_image->width == W && shm_image->height == H)
+      return shm_image;
+
+   int screen = DefaultScreen(display);
+   if (shm_image != NULL) {
+      // Another size: only the image header has to change (it's client side
+      // only) as long as the attached segment can hold the pixels
+      XImage *image = XShmCreateImage(display, DefaultVisual(display, screen), DefaultDepth(display, screen),
+                                      ZPixmap, shminfo.shmaddr, &shminfo, W, H);
+      if (image != NULL && (size_t) image->bytes_per_line * image->height <= shm_size) {
+         shm_image->data = NULL;
+         XDestroyImage(shm_image);
+         shm_image = image;
+         return shm_image;
+      }
+      if (image != NULL) {
+         image->data = NULL;
+         XDestroyImage(image);
+      }
+   }
+
+   shmRelease();
+
+   shm_image = XShmCreateImage(display, DefaultVisual(display, screen), DefaultDepth(display, screen),
+                               ZPixmap, NULL, &shminfo, W, H);
+   if (shm_image == NULL)
+      goto fail;
+
+   shm_size = (size_t) shm_image->bytes_per_line * shm_image->height;
+   shminfo.shmid = shmget(IPC_PRIVATE, shm_size, IPC_CREAT | 0600);
+   if (shminfo.shmid < 0)
+      goto fail_image;
+
+   shminfo.shmaddr = shm_image->data = shmat(shminfo.shmid, NULL, 0);
+   if (shminfo.shmaddr == (char *) -1) {
+      shmctl(shminfo.shmid, IPC_RMID, NULL);
+      goto fail_image;
+   }
+   shminfo.readOnly = False;
+
+   x_error_code = 0;
+   XShmAttach(display, &shminfo);
+   XSync(display, False);
+   // Mark the segment for removal now: it goes away as soon as both we and
+   // the X server detach, even if the daemon gets killed
+   shmctl(shminfo.shmid, IPC_RMID, NULL);
+
+   if (x_error_code != 0) {
+      // e.g. a remote display that can't see our memory
+      shmdt(shminfo.shmaddr);
+      goto fail_image;
+   }
+   use_shm = 1;
+   return shm_image;
+
+fail_image:
+   shm_image->data = NULL;
+   XDestroyImage(shm_image);
+   shm_image = NULL;
+   shm_size = 0;
+fail:
+   use_shm = 0;
+   return NULL;
+}
+
+// Capture a region of the root window. *owned is set when the caller has to
+// XDestroyImage the result, i.e. when the XGetImage fallback was used.
+static XImage *capture(const int xx, const int yy, const int W, const int H, /*out*/ int *owned)
 {
-   Display *display = XOpenDisplay(NULL);
-   Window root = DefaultRootWindow(display);
+   *owned = 0;
+   if (use_shm != 0) {
+      XImage *image = shmAcquire(W, H);
+      if (image != NULL) {
+         x_error_code = 0;
+         if (XShmGetImage(display, root, image, xx, yy, AllPlanes) && x_error_code == 0)
+            return image;
+      }
+   }
 
-   XImage *image = XGetImage(display,root, xx,yy, W,H, AllPlanes, ZPixmap);
+   x_error_code = 0;
+   XImage *image = XGetImage(display, root, xx, yy, W, H, AllPlanes, ZPixmap);
+   if (image != NULL)
+      *owned = 1;
+   return image;
+}
 
+static int maskShift(unsigned long mask)
+{
+   int shift = 0;
+   if (mask == 0)
+      return 0;
+   while (!(mask & 1)) {
+      mask >>= 1;
+      shift++;
+   }
+   return shift;
+}
+
+// Convert one row of an XImage into native endian 0xAARRGGBB words (BGRA
+// bytes on little endian machines). The common 24/32 bit TrueColor layout
+// only needs the alpha byte forced, everything else goes through the masks.
+static void convertRow(XImage *image, const int y, const int W, /*out*/ uint32_t *dst)
+{
    unsigned long red_mask   = image->red_mask;
    unsigned long green_mask = image->green_mask;
    unsigned long blue_mask  = image->blue_mask;
-   int x, y;
-   int ii = 0;
-   for (y = 0; y < H; y++) {
-       for (x = 0; x < W; x++) {
-         unsigned long pixel = XGetPixel(image,x,y);
-         unsigned char blue  = (pixel & blue_mask);
-         unsigned char green = (pixel & green_mask) >> 8;
-         unsigned char red   = (pixel & red_mask) >> 16;
-
-         data[ii + 2] = blue;
-         data[ii + 1] = green;
-         data[ii + 0] = red;
-         ii += 3;
+   int x;
+
+   int native_order = (image->byte_order == LSBFirst) == (PIXEL_LITTLE_ENDIAN);
+   if (image->bits_per_pixel == 32 && native_order &&
+       red_mask == 0xff0000 && green_mask == 0xff00 && blue_mask == 0xff) {
+      const uint32_t *src = (const uint32_t *) (image->data + (size_t) y * image->bytes_per_line);
+      for (x = 0; x < W; x++)
+         dst[x] = src[x] | 0xff000000;
+      return;
+   }
+
+   int red_shift = maskShift(red_mask), green_shift = maskShift(green_mask), blue_shift = maskShift(blue_mask);
+   unsigned long red_max = red_mask >> red_shift, green_max = green_mask >> green_shift,
+                 blue_max = blue_mask >> blue_shift;
+   if (!red_max) red_max = 1;
+   if (!green_max) green_max = 1;
+   if (!blue_max) blue_max = 1;
+   for (x = 0; x < W; x++) {
+      unsigned long pixel = XGetPixel(image, x, y);
+      uint32_t red   = ((pixel & red_mask) >> red_shift) * 255 / red_max;
+      uint32_t green = ((pixel & green_mask) >> green_shift) * 255 / green_max;
+      uint32_t blue  = ((pixel & blue_mask) >> blue_shift) * 255 / blue_max;
+      dst[x] = 0xff000000 | (red << 16) | (green << 8) | blue;
+   }
+}
+
+// Convert the image into (W / scale) x (H / scale) pixels, averaging each
+// scale x scale block (box filter). Leftover rows/columns are dropped.
+// Returns 0 if the scratch memory couldn't be allocated.
+static int convertImage(XImage *image, const int W, const int H, const int scale, /*out*/ uint32_t *data)
+{
+   int y;
+
+   if (scale == 1) {
+      for (y = 0; y < H; y++)
+         convertRow(image, y, W, data + (size_t) y * W);
+      return 1;
+   }
+
+   const int OW = W / scale, OH = H / scale;
+   uint32_t *row = malloc(sizeof(uint32_t) * W);
+   uint32_t *sums = malloc(sizeof(uint32_t) * 3 * OW);
+   if (row == NULL || sums == NULL) {
+      free(row);
+      free(sums);
+      return 0;
+   }
+
+   const uint32_t area = scale * scale;
+   int oy, sy, ox, sx;
+   for (oy = 0; oy < OH; oy++) {
+      memset(sums, 0, sizeof(uint32_t) * 3 * OW);
+      for (sy = 0; sy < scale; sy++) {
+         convertRow(image, oy * scale + sy, W, row);
+         const uint32_t *src = row;
+         for (ox = 0; ox < OW; ox++) {
+            uint32_t *sum = sums + 3 * ox;
+            for (sx = 0; sx < scale; sx++, src++) {
+               sum[0] += (*src >> 16) & 0xff;
+               sum[1] += (*src >> 8) & 0xff;
+               sum[2] += *src & 0xff;
+            }
+         }
+      }
+      uint32_t *dst = data + (size_t) oy * OW;
+      for (ox = 0; ox < OW; ox++) {
+         const uint32_t *sum = sums + 3 * ox;
+         dst[ox] = 0xff000000 | ((sum[0] / area) << 16) | ((sum[1] / area) << 8) | (sum[2] / area);
       }
    }
+   free(row);
+   free(sums);
+   return 1;
+}
+
+// Outcome of the Xlib work of a method, turned into a Python error (if any)
+// once the GIL is held again
+enum { GRAB_OK, GRAB_NO_DISPLAY, GRAB_FAILED, GRAB_NO_MEMORY };
+
+static PyObject *setXError(int status, const char *what, int error_code)
+{
+   if (status == GRAB_NO_DISPLAY)
+      PyErr_SetString(PyExc_OSError, "cannot open X display");
+   else if (status == GRAB_NO_MEMORY)
+      PyErr_NoMemory();
+   else
+      PyErr_Format(PyExc_RuntimeError, "capture of %s failed (X error %d)", what, error_code);
+   return NULL;
+}
+
+// Capture a region of the root window into data, see convertImage
+static int grabScreen(const int xx, const int yy, const int W, const int H, const int scale,
+                      /*out*/ uint32_t *data, /*out*/ int *error_code)
+{
+   if (!openDisplay())
+      return GRAB_NO_DISPLAY;
+
+   int owned, status = GRAB_OK;
+   XImage *image = capture(xx, yy, W, H, &owned);
+   if (image == NULL) {
+      *error_code = x_error_code;
+      return GRAB_FAILED;
+   }
+   if (!convertImage(image, W, H, scale, data))
+      status = GRAB_NO_MEMORY;
+   if (owned)
+      XDestroyImage(image);
+   return status;
+}
+
+static PyObject *getScreenBufferMethod(PyObject *self, PyObject *args) {
+    int xx, yy, W, H;
+    int scale = 1;
+    if (!PyArg_ParseTuple(args, "iiii|i", &xx, &yy, &W, &H, &scale)) {
+        return NULL;
+    }
+    if (W <= 0 || H <= 0) {
+        PyErr_SetString(PyExc_ValueError, "invalid capture size");
+        return NULL;
+    }
+    if (scale < 1 || scale > W || scale > H) {
+        PyErr_SetString(PyExc_ValueError, "invalid scale factor");
+        return NULL;
+    }
+
+    // The bytearray is handed out as is: it exposes the buffer protocol, so
+    // the caller can wrap it (e.g. pygame.image.frombuffer) without copying.
+    // Nothing else knows about it yet, so it's filled without the GIL
+    PyObject *result = PyByteArray_FromStringAndSize(NULL, (Py_ssize_t) (W / scale) * (H / scale) * 4);
+    if (result == NULL)
+        return NULL;
+    uint32_t *data = (uint32_t *) PyByteArray_AS_STRING(result);
+
+    int status, error_code = 0;
+    X_BEGIN
+    status = grabScreen(xx, yy, W, H, scale, data, &error_code);
+    X_END
+    if (status != GRAB_OK) {
+        char what[64];
+        Py_DECREF(result);
+        snprintf(what, sizeof(what), "%dx%d+%d+%d", W, H, xx, yy);
+        return setXError(status, what, error_code);
+    }
+    return result;
+}
+
+// 1 if damage tracking is (now) running, 0 if XDamage isn't available
+static int startDamage(void)
+{
+   if (damage != None)
+      return 1;
+
+   int fixes_event_base, error_base, major = 1, minor = 1;
+   if (!XDamageQueryExtension(display, &damage_event_base, &error_base) ||
+       !XDamageQueryVersion(display, &major, &minor))
+      return 0;
+   major = 2;
+   minor = 0;
+   if (!XFixesQueryExtension(display, &fixes_event_base, &error_base) ||
+       !XFixesQueryVersion(display, &major, &minor))
+      return 0;
+
+   // NonEmpty: a single notification when the damage goes from empty to
+   // non-empty, the rest is accumulated by the server until getDamage
+   x_error_code = 0;
+   damage = XDamageCreate(display, root, XDamageReportNonEmpty);
+   damage_region = XFixesCreateRegion(display, NULL, 0);
+   XSync(display, False);
+   if (x_error_code != 0) {
+      XDamageDestroy(display, damage);
+      XFixesDestroyRegion(display, damage_region);
+      damage = None;
+      damage_region = None;
+      return 0;
+   }
+   return 1;
+}
+
+static PyObject *damageStartMethod(PyObject *self, PyObject *args) {
+    int status = GRAB_OK, started = 0;
+    X_BEGIN
+    if (!openDisplay())
+        status = GRAB_NO_DISPLAY;
+    else
+        started = startDamage();
+    X_END
+    if (status != GRAB_OK)
+        return setXError(status, NULL, 0);
+    return PyBool_FromLong(started);
+}
+
+// The damaged rectangles since the previous call (NULL if none, to XFree
+// otherwise), and their bounding box
+static XRectangle *fetchDamage(/*out*/ int *count, /*out*/ XRectangle *bounds)
+{
+   // Drain the event queue (replies to captures may have read events into
+   // it already, so this doesn't rely on the connection being readable)
+   *count = 0;
+   while (XPending(display)) {
+      XEvent event;
+      XNextEvent(display, &event);
+      if (event.type == damage_event_base + XDamageNotify)
+         damage_notified = 1;
+   }
+   if (!damage_notified)
+      return NULL;
+   damage_notified = 0;
+
+   // Move the accumulated damage into our region and read it back
+   XDamageSubtract(display, damage, None, damage_region);
+   return XFixesFetchRegionAndBounds(display, damage_region, count, bounds);
+}
+
+static PyObject *getDamageMethod(PyObject *self, PyObject *args) {
+    int started, count = 0;
+    XRectangle bounds, *rects = NULL;
+    X_BEGIN
+    started = damage != None;
+    if (started)
+        rects = fetchDamage(&count, &bounds);
+    X_END
+    if (!started) {
+        PyErr_SetString(PyExc_RuntimeError, "damage tracking not started");
+        return NULL;
+    }
+
+    PyObject *result;
+    int i;
+    if (count > MAX_DAMAGE_RECTS) {
+        result = Py_BuildValue("[(iiii)]", bounds.x, bounds.y, bounds.width, bounds.height);
+    } else {
+        result = PyList_New(count);
+        for (i = 0; result != NULL && i < count; i++) {
+            PyObject *rect = Py_BuildValue("(iiii)", rects[i].x, rects[i].y, rects[i].width, rects[i].height);
+            if (rect == NULL)
+                Py_CLEAR(result);
+            else
+                PyList_SET_ITEM(result, i, rect);
+        }
+    }
+    if (rects != NULL)
+        XFree(rects);
+    return result;
+}
+
+// 1 if the top level windows are (now) redirected, 0 if XComposite isn't
+// available
+static int startComposite(void)
+{
+   if (composite_started)
+      return 1;
+
+   // NameWindowPixmap needs Composite 0.2
+   int event_base, error_base, major = 0, minor = 2;
+   if (!XCompositeQueryExtension(display, &event_base, &error_base) ||
+       !XCompositeQueryVersion(display, &major, &minor) || (major == 0 && minor < 2))
+      return 0;
+
+   // Automatic redirection: the server still draws the screen as usual (so
+   // it doesn't get in the way of a compositing manager), but every top
+   // level window gets its own backing pixmap
+   x_error_code = 0;
+   XCompositeRedirectSubwindows(display, root, CompositeRedirectAutomatic);
+   XSync(display, False);
+   if (x_error_code != 0)
+      return 0;
+   composite_started = 1;
+   return 1;
+}
+
+static PyObject *compositeStartMethod(PyObject *self, PyObject *args) {
+    int status = GRAB_OK, started = 0;
+    X_BEGIN
+    if (!openDisplay())
+        status = GRAB_NO_DISPLAY;
+    else
+        started = startComposite();
+    X_END
+    if (status != GRAB_OK)
+        return setXError(status, NULL, 0);
+    return PyBool_FromLong(started);
+}
+
+// The child of the root window holding window, i.e. the frame i3 reparented
+// a client window into. None if the window is gone.
+static Window topLevel(Window window)
+{
+   Window root_return, parent, *children;
+   unsigned int count;
+   while (window != None) {
+      if (!XQueryTree(display, window, &root_return, &parent, &children, &count))
+         return None;
+      if (children != NULL)
+         XFree(children);
+      if (parent == root_return)
+         return window;
+      window = parent;
+   }
+   return None;
+}
+
+// Name the pixmap of the frame of window, None if the window isn't viewable
+static Pixmap namePixmap(Window window, /*out*/ XWindowAttributes *attributes)
+{
+   // Only a mapped window has contents: the pixmap named now keeps the last
+   // ones after the window is unmapped (e.g. its workspace is hidden)
+   x_error_code = 0;
+   Window frame = topLevel(window);
+   if (frame == None || !XGetWindowAttributes(display, frame, attributes) ||
+       attributes->map_state != IsViewable || x_error_code != 0)
+      return None;
+
+   Pixmap pixmap = XCompositeNameWindowPixmap(display, frame);
+   XSync(display, False);
+   return x_error_code != 0 ? None : pixmap;
+}
+
+static PyObject *nameWindowPixmapMethod(PyObject *self, PyObject *args) {
+    unsigned long window;
+    if (!PyArg_ParseTuple(args, "k", &window)) {
+        return NULL;
+    }
+
+    int started;
+    Pixmap pixmap = None;
+    XWindowAttributes attributes;
+    X_BEGIN
+    started = composite_started;
+    if (started)
+        pixmap = namePixmap(window, &attributes);
+    X_END
+    if (!started) {
+        PyErr_SetString(PyExc_RuntimeError, "composite redirection not started");
+        return NULL;
+    }
+    if (pixmap == None)
+        Py_RETURN_NONE;
+
+    // The pixmap covers the border of the window too
+    return Py_BuildValue("(kiiii)", pixmap, attributes.x, attributes.y,
+                         attributes.width + 2 * attributes.border_width,
+                         attributes.height + 2 * attributes.border_width);
+}
+
+static PyObject *freePixmapMethod(PyObject *self, PyObject *args) {
+    unsigned long pixmap;
+    if (!PyArg_ParseTuple(args, "k", &pixmap)) {
+        return NULL;
+    }
+    X_BEGIN
+    if (display != NULL && pixmap != None) {
+        XFreePixmap(display, pixmap);
+        XFlush(display);
+    }
+    X_END
+    Py_RETURN_NONE;
+}
+
+// Read a pixmap of nameWindowPixmap into data, see convertImage
+static int grabPixmap(Pixmap pixmap, const int W, const int H, const int scale,
+                      /*out*/ uint32_t *data, /*out*/ int *error_code)
+{
+   if (!openDisplay())
+      return GRAB_NO_DISPLAY;
+
+   // Pixmaps can have another depth than the root window (e.g. 32 bit ARGB
+   // windows), which XShmGetImage with the shared segment can't handle
+   x_error_code = 0;
+   XImage *image = XGetImage(display, pixmap, 0, 0, W, H, AllPlanes, ZPixmap);
+   if (image == NULL) {
+      *error_code = x_error_code;
+      return GRAB_FAILED;
+   }
+   if (image->red_mask == 0 && image->green_mask == 0 && image->blue_mask == 0) {
+      // There's no visual attached to a pixmap, the window ones are TrueColor
+      Visual *visual = DefaultVisual(display, DefaultScreen(display));
+      image->red_mask = visual->red_mask;
+      image->green_mask = visual->green_mask;
+      image->blue_mask = visual->blue_mask;
+   }
+
+   int status = convertImage(image, W, H, scale, data) ? GRAB_OK : GRAB_NO_MEMORY;
    XDestroyImage(image);
-   XDestroyWindow(display, root);
-   XCloseDisplay(display);
+   return status;
 }
 
-static PyObject *getScreenMethod(PyObject *self, PyObject *args) {
-   int xx, yy, W, H;
-    if (!PyArg_ParseTuple(args, "iiii", &xx, &yy, &W, &H)) {
-        PyErr_SetString(PyExc_TypeError, "arguments exception");
-        return Py_None;
+static PyObject *getPixmapBufferMethod(PyObject *self, PyObject *args) {
+    unsigned long pixmap;
+    int W, H;
+    int scale = 1;
+    if (!PyArg_ParseTuple(args, "kii|i", &pixmap, &W, &H, &scale)) {
+        return NULL;
+    }
+    if (W <= 0 || H <= 0) {
+        PyErr_SetString(PyExc_ValueError, "invalid capture size");
+        return NULL;
+    }
+    if (scale < 1 || scale > W || scale > H) {
+        PyErr_SetString(PyExc_ValueError, "invalid scale factor");
+        return NULL;
+    }
+
+    PyObject *result = PyByteArray_FromStringAndSize(NULL, (Py_ssize_t) (W / scale) * (H / scale) * 4);
+    if (result == NULL)
+        return NULL;
+    uint32_t *data = (uint32_t *) PyByteArray_AS_STRING(result);
+
+    int status, error_code = 0;
+    X_BEGIN
+    status = grabPixmap(pixmap, W, H, scale, data, &error_code);
+    X_END
+    if (status != GRAB_OK) {
+        char what[64];
+        Py_DECREF(result);
+        snprintf(what, sizeof(what), "pixmap 0x%lx", pixmap);
+        return setXError(status, what, error_code);
     }
-    int data_size = sizeof(unsigned char) * W * H * 3;
-    unsigned char *data = (unsigned char *) malloc(data_size);
-    getScreen(xx, yy, W, H, data);
-    PyObject *result = Py_BuildValue("y#", data, data_size);
-    free(data);
     return result;
 }
 
+static PyObject *connectionNumberMethod(PyObject *self, PyObject *args) {
+    int fd = -1;
+    X_BEGIN
+    if (openDisplay())
+        fd = ConnectionNumber(display);
+    X_END
+    if (fd < 0)
+        return setXError(GRAB_NO_DISPLAY, NULL, 0);
+    return PyLong_FromLong(fd);
+}
+
 static PyMethodDef prtscnMethods[] = {
-    {"getScreen", getScreenMethod, METH_VARARGS, ""},
+    {"getScreenBuffer", getScreenBufferMethod, METH_VARARGS,
+     "getScreenBuffer(x, y, w, h[, scale]) -> bytearray of (w / scale) * (h / scale) pixels in PIXEL_FORMAT"},
+    {"damageStart", damageStartMethod, METH_NOARGS,
+     "Start tracking damage of the root window, returns False if XDamage is not available"},
+    {"getDamage", getDamageMethod, METH_NOARGS,
+     "getDamage() -> list of (x, y, w, h) damaged since the previous call"},
+    {"compositeStart", compositeStartMethod, METH_NOARGS,
+     "Redirect the top level windows to pixmaps, returns False if XComposite is not available"},
+    {"nameWindowPixmap", nameWindowPixmapMethod, METH_VARARGS,
+     "nameWindowPixmap(window) -> (pixmap, x, y, w, h) of the frame of a mapped client window, or None"},
+    {"freePixmap", freePixmapMethod, METH_VARARGS, "freePixmap(pixmap): release a pixmap of nameWindowPixmap"},
+    {"getPixmapBuffer", getPixmapBufferMethod, METH_VARARGS,
+     "getPixmapBuffer(pixmap, w, h[, scale]) -> bytearray of (w / scale) * (h / scale) pixels in PIXEL_FORMAT"},
+    {"connectionNumber", connectionNumberMethod, METH_NOARGS,
+     "File descriptor of the X connection, readable when events (e.g. damage) arrive"},
     {NULL, NULL, 0, NULL}
 };
 
@@ -63,5 +657,14 @@ static struct PyModuleDef prtscn = {
     prtscnMethods
 };
 PyMODINIT_FUNC PyInit_prtscn(void) {
-   return PyModule_Create(&prtscn);
+   PyObject *module = PyModule_Create(&prtscn);
+   if (module == NULL)
+      return NULL;
+   // Byte order of the 0xAARRGGBB words returned by getScreenBuffer, as a
+   // pygame.image.frombuffer format string
+   if (PyModule_AddStringConstant(module, "PIXEL_FORMAT", PIXEL_LITTLE_ENDIAN ? "BGRA" : "ARGB") < 0) {
+      Py_DECREF(module);
+      return NULL;
+   }
+   return module;
 }
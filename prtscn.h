@@ -1,8 +1,42 @@
 #define PY_SSIZE_T_CLEAN
 #include <Python.h>
+#include <stdint.h>
+#include <X11/Xlib.h>
 
-static void getScreen(const int, const int, const int, const int, unsigned char *);
+static void convertRow(XImage *, const int, const int, uint32_t *);
 
-static PyObject *getScreenMethod(PyObject *, PyObject *);
+static int convertImage(XImage *, const int, const int, const int, uint32_t *);
+
+static PyObject *setXError(int, const char *, int);
+
+static int grabScreen(const int, const int, const int, const int, const int, uint32_t *, int *);
+
+static PyObject *getScreenBufferMethod(PyObject *, PyObject *);
+
+static int startDamage(void);
+
+static XRectangle *fetchDamage(int *, XRectangle *);
+
+static PyObject *damageStartMethod(PyObject *, PyObject *);
+
+static PyObject *getDamageMethod(PyObject *, PyObject *);
+
+static int startComposite(void);
+
+static PyObject *compositeStartMethod(PyObject *, PyObject *);
+
+static Window topLevel(Window);
+
+static Pixmap namePixmap(Window, XWindowAttributes *);
+
+static PyObject *nameWindowPixmapMethod(PyObject *, PyObject *);
+
+static PyObject *freePixmapMethod(PyObject *, PyObject *);
+
+static int grabPixmap(Pixmap, const int, const int, const int, uint32_t *, int *);
+
+static PyObject *getPixmapBufferMethod(PyObject *, PyObject *);
+
+static PyObject *connectionNumberMethod(PyObject *, PyObject *);
 
 PyMODINIT_FUNC PyInit_prtscn(void);
\ No newline at end of file
@@ -4,7 +4,7 @@ from setuptools import setup, Extension, find_packages
 prtscn = Extension(
     'prtscn',
     sources=['prtscn.c'],
-    libraries=['X11'],
+    libraries=['X11', 'Xext', 'Xdamage', 'Xfixes', 'Xcomposite'],
     language='c',
 )
 
@@ -12,7 +12,8 @@ setup(
     name='i3expod',
     version='0.0.0',
     description='Exposè for i3 WM',
-    scripts=['i3expod.py'],
+    scripts=['i3expod.py', 'i3expoctl.py'],
+    py_modules=['expolayout', 'expoanim', 'i3expoctl'],
     ext_modules=[prtscn],
     license='MIT',
     packages=find_packages(),
@@ -25,7 +26,8 @@ setup(
     ],
     entry_points={
         'console_scripts': [
-            'i3expod=i3expod:main'
+            'i3expod=i3expod:main',
+            'i3expoctl=i3expoctl:main'
         ]
     }
 )